@@ -3,6 +3,7 @@ import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
 from authService.auth.router import router as auth_router
 from configs.config import settings
+from common.metrics import setup_metrics
 
 app = FastAPI(title="AuthService")
 app.add_middleware(
@@ -10,8 +11,10 @@ app.add_middleware(
     allow_origins = settings.HOSTS,
     allow_methods = settings.METHODS,
     allow_headers = settings.HEADERS,
-    allow_credentials=settings.CREDENTIALS
+    allow_credentials=settings.CREDENTIALS,
+    expose_headers=[settings.REQUEST_ID_HEADER]
 )
+setup_metrics(app)
 app.include_router(auth_router, tags=["auth"], prefix="/auth")
 
 if __name__ == "__main__":
@@ -0,0 +1,43 @@
+from collections import OrderedDict
+import time
+from configs.config import settings
+from dbmodels.schemas import UserBase
+
+
+class UserCache:
+    """
+    Кэш пользователей по id с TTL и ограничением размера (LRU).
+    Кэш локален для процесса: после change_active его сбрасывает только
+    сервис авторизации, в остальных сервисах запись живёт не дольше TTL.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+
+    def get(self, user_id: str):
+        item = self._items.get(user_id)
+        if item is None:
+            return None
+        expires, user = item
+        if expires < time.monotonic():
+            del self._items[user_id]
+            return None
+        self._items.move_to_end(user_id)
+        return user
+
+    def put(self, user: UserBase):
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        user_id = str(user.id)
+        self._items[user_id] = (time.monotonic() + self.ttl, user)
+        self._items.move_to_end(user_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, user_id):
+        self._items.pop(str(user_id), None)
+
+
+USER_CACHE = UserCache(max_size=settings.AUTH_USER_CACHE_SIZE, ttl=settings.AUTH_USER_CACHE_TTL)
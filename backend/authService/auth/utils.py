@@ -1,19 +1,49 @@
-from fastapi import Depends, Request
-from dbmodels.crud import get_user_by_id, get_user_by_email
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+from fastapi import Depends, HTTPException, Request, status
+from common.metrics import stage
+from dbmodels.crud import change_active, change_password_hash, get_user_by_id, get_user_by_email
 from datetime import datetime, timedelta, timezone
 from configs.config import settings
 from passlib.context import CryptContext
 import jwt
 from jwt.exceptions import InvalidTokenError
-from dbmodels.database import db_dependency
+from dbmodels.database import async_session_maker, db_dependency, release_connection
+from dbmodels.schemas import UserBase
+from .cache import USER_CACHE
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# bcrypt отпускает GIL, поэтому хэширование в отдельных потоках не блокирует
+# event loop; число потоков и длина очереди ограничены.
+_hash_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_pending = 0
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def _run_hashing(fn, *args):
+    global _hash_pending
+    if _hash_pending >= settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_SIZE:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Сервис перегружен, попробуйте позже",
+                            headers={"Retry-After": str(settings.PASSWORD_HASH_RETRY_AFTER)})
+    _hash_pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        with stage("password_hash"):
+            return await loop.run_in_executor(_hash_executor, functools.partial(fn, *args))
+    finally:
+        _hash_pending -= 1
+
+async def verify_and_update_password(plain_password, hashed_password):
+    """Возвращает (valid, new_hash); new_hash не None, если сменилась стоимость bcrypt."""
+    return await _run_hashing(pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def verify_password(plain_password, hashed_password):
+    valid, _ = await verify_and_update_password(plain_password, hashed_password)
+    return valid
+
+async def get_password_hash(password):
+    return await _run_hashing(pwd_context.hash, password)
 
 def create_token(data: dict, expire_time: timedelta):
     to_encode = data.copy()
@@ -22,10 +52,34 @@ def create_token(data: dict, expire_time: timedelta):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
+def user_claims(user: UserBase):
+    # Данные пользователя в токене: при AUTH_USER_CLAIMS проверка не ходит в БД
+    if not settings.AUTH_USER_CLAIMS:
+        return {}
+    return {
+        "email": user.email,
+        "is_active": True,
+        "created_at": int(user.created_at.replace(tzinfo=timezone.utc).timestamp()),
+        "updated_at": int(user.updated_at.replace(tzinfo=timezone.utc).timestamp()),
+    }
+
+async def change_user_active(user_id, active: bool):
+    # Фоновая задача: сессия запроса к этому моменту уже закрыта
+    async with async_session_maker() as db:
+        result = await change_active(user_id, active, db)
+    USER_CACHE.invalidate(user_id)
+    return result
+
 async def authenticate_user(email: str, password: str, db: db_dependency):
     user = await get_user_by_email(email, db)
-    if not user or verify_password(plain_password=password, hashed_password=user.hashed_password) is False:
+    if not user:
         return None
+    await release_connection(db)
+    valid, new_hash = await verify_and_update_password(plain_password=password, hashed_password=user.hashed_password)
+    if not valid:
+        return None
+    if new_hash is not None:
+        await change_password_hash(user.id, new_hash, db)
     return user
 
 def get_access_token(request: Request):
@@ -54,6 +108,16 @@ def check_valid_token(token = Depends(get_access_token)):
         return None
     return decode_token
 
+def _user_from_claims(payload: dict):
+    try:
+        return UserBase(id=payload["sub"],
+                        email=payload["email"],
+                        is_active=payload["is_active"],
+                        created_at=datetime.fromtimestamp(payload["created_at"], tz=timezone.utc).replace(tzinfo=None),
+                        updated_at=datetime.fromtimestamp(payload["updated_at"], tz=timezone.utc).replace(tzinfo=None))
+    except (KeyError, ValueError, TypeError):
+        return None
+
 async def get_current_user(payload: dict = Depends(check_valid_token), db: db_dependency = db_dependency):
     if payload is None:
         return None
@@ -63,9 +127,21 @@ async def get_current_user(payload: dict = Depends(check_valid_token), db: db_de
     if not user_id:
         return None
 
+    if settings.AUTH_USER_CLAIMS:
+        user = _user_from_claims(payload)
+        if user is not None:
+            return user
+
+    user = USER_CACHE.get(user_id)
+    if user is not None:
+        return user
+
     user = await get_user_by_id(id=user_id, db=db)
+    await release_connection(db)
 
     if user is None:
         return None
 
+    user = UserBase.model_validate(user)
+    USER_CACHE.put(user)
     return user
\ No newline at end of file
@@ -0,0 +1,56 @@
+"""
+Сериализация ответа с предсказанием: stdlib JSONResponse против
+common.responses.JSONResponse (orjson) и размер ответа после gzip/brotli.
+
+    python -m benchmarks.bench_json --detections 20 --points 500
+"""
+import argparse
+import gzip
+import numpy as np
+from starlette.responses import JSONResponse as StdlibJSONResponse
+from configs.config import settings
+from common.responses import JSONResponse, orjson
+from modelService.modelseg.tiling import compute_windows
+from modelService.modelseg.utils import processed_prediction
+from .bench_postprocess import make_results, timeit
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def main(args):
+    windows = compute_windows(args.height, args.width)
+    results = make_results(windows, args.detections, args.points, np.random.default_rng(0))
+    pred = processed_prediction(results, windows, args.height, args.width)
+    content = {"00000000-0000-0000-0000-000000000000": pred}
+    print(f"detections={pred['detected_objects']} points={sum(len(m) for m in pred['masks'])} orjson={'yes' if orjson else 'no'}")
+
+    rows = []
+    stdlib_time = timeit(lambda: StdlibJSONResponse(content).body, args.repeat)
+    body = JSONResponse(content).body
+    fast_time = timeit(lambda: JSONResponse(content).body, args.repeat)
+    rows.append(("stdlib json", stdlib_time, len(StdlibJSONResponse(content).body)))
+    rows.append(("JSONResponse", fast_time, len(body)))
+
+    level = settings.GZIP_LEVEL
+    gzip_time = timeit(lambda: gzip.compress(body, compresslevel=level), args.repeat)
+    rows.append((f"+ gzip {level}", fast_time + gzip_time, len(gzip.compress(body, compresslevel=level))))
+    if brotli is not None:
+        quality = settings.BROTLI_QUALITY
+        br_time = timeit(lambda: brotli.compress(body, quality=quality), args.repeat)
+        rows.append((f"+ brotli {quality}", fast_time + br_time, len(brotli.compress(body, quality=quality))))
+
+    for name, seconds, size in rows:
+        print(f"{name:<14} {seconds * 1000:8.1f} ms {size / 1024:10.1f} KB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="JSON response serialization benchmark")
+    parser.add_argument("--height", type=int, default=640)
+    parser.add_argument("--width", type=int, default=17920)
+    parser.add_argument("--detections", type=int, default=20, help="detections per tile")
+    parser.add_argument("--points", type=int, default=500, help="vertices per mask")
+    parser.add_argument("--repeat", type=int, default=5)
+    main(parser.parse_args())
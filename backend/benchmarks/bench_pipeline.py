@@ -0,0 +1,297 @@
+"""
+Офлайн-бенчмарк конвейера /model/predict по этапам, без Postgres, S3 и весов:
+снимки синтетические (или из --fixtures), S3 заменён хранилищем в памяти,
+БД — кодированием геометрии в bytea, как в add_predictions_to_files,
+а YOLO — крошечной свёрточной сетью с синтетическими детекциями.
+
+    python -m benchmarks.bench_pipeline --widths 4480 8960 17920 --images 3 --repeat 5
+    python -m benchmarks.bench_pipeline --json before.json
+    python -m benchmarks.bench_pipeline --baseline before.json
+
+Этапы: download, decode, split, inference, postprocess, serialize (тело ответа),
+db_encode, draw и pdf (отчёт). Для каждой ширины выводятся p50/p99 этапов,
+пропускная способность и пиковый RSS процесса (он только растёт, поэтому
+ширины прогоняются по возрастанию). --weights подставляет настоящую модель
+через backends.load_model. Шрифт DejaVuSans.ttf для PDF ищется так же,
+как в сервисе, — в рабочем каталоге.
+"""
+import argparse
+import asyncio
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import platform
+import resource
+import subprocess
+import sys
+import time
+import cv2
+import numpy as np
+import torch
+from common.responses import json_dumps
+from configs.config import settings
+from dbmodels.codecs import encode_boxes, encode_polygons, masks_dtype_for
+from modelService.modelseg.cache import tiler_config
+from modelService.modelseg.reports import draw_prediction
+from modelService.modelseg.utils import decode_image, download_image, gen_pdf, processed_prediction, split_img
+from .bench_postprocess import FakeResult, make_results
+from .fixtures import encode_image, synthetic_radiograph
+
+STAGES = ("download", "decode", "split", "inference", "postprocess", "serialize", "db_encode", "draw", "pdf")
+
+
+class StubBody:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def iter_chunks(self, chunk_size: int):
+        for start in range(0, len(self._data), chunk_size):
+            yield self._data[start:start + chunk_size]
+
+
+class StubS3:
+    """Хранилище в памяти с тем подмножеством API aiobotocore, которое использует конвейер."""
+
+    def __init__(self):
+        self.objects = {}
+
+    async def get_object(self, Bucket: str, Key: str):
+        data = self.objects[(Bucket, Key)]
+        return {"ContentLength": len(data), "Body": StubBody(data)}
+
+    async def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs):
+        self.objects[(Bucket, Key)] = bytes(Body)
+
+
+class StandInModel:
+    """
+    Замена YOLO без весов: плитки проходят letterbox до imgsz и три свёртки
+    (нагрузка растёт с числом плиток, как у настоящей модели), а детекции —
+    синтетические полигоны из bench_postprocess.make_results.
+    """
+    names = FakeResult.names
+
+    def __init__(self, imgsz: int, detections: int, points: int, seed: int = 0):
+        self.imgsz = imgsz
+        self.detections = detections
+        self.points = points
+        self.rng = np.random.default_rng(seed)
+        torch.manual_seed(seed)
+        self.net = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 8, 3, stride=2, padding=1), torch.nn.ReLU(),
+            torch.nn.Conv2d(8, 16, 3, stride=2, padding=1), torch.nn.ReLU(),
+            torch.nn.Conv2d(16, 32, 3, stride=2, padding=1),
+        ).eval()
+
+    def _letterbox(self, tile: np.ndarray):
+        height, width = tile.shape[:2]
+        scale = self.imgsz / max(height, width)
+        resized = cv2.resize(tile, (max(1, round(width * scale)), max(1, round(height * scale))))
+        canvas = np.full((self.imgsz, self.imgsz, 3), 114, dtype=np.uint8)
+        canvas[:resized.shape[0], :resized.shape[1]] = resized
+        return canvas
+
+    def predict(self, tiles: list, verbose: bool = False):
+        batch = np.stack([self._letterbox(tile) for tile in tiles])
+        with torch.inference_mode():
+            self.net(torch.from_numpy(batch).permute(0, 3, 1, 2).float().div_(255))
+        shapes = np.array([(0, 0, tile.shape[1], tile.shape[0]) for tile in tiles])
+        return make_results(shapes, self.detections, self.points, self.rng)
+
+
+@contextmanager
+def timed(timings: dict, name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - started
+
+
+async def run_once(s3: StubS3, key: str, model):
+    timings = {}
+    with timed(timings, "download"):
+        bytes_img = await download_image(s3=s3, path_to_image=key)
+    with timed(timings, "decode"):
+        image = decode_image(bytes_img)
+    with timed(timings, "split"):
+        tiles, windows = split_img(combined_image=image)
+    with timed(timings, "inference"):
+        result = model.predict(tiles, verbose=False)
+    height, width = image.shape[:2]
+    with timed(timings, "postprocess"):
+        pred = processed_prediction(result, windows, height, width)
+    with timed(timings, "serialize"):
+        json_dumps({key: pred})
+    with timed(timings, "db_encode"):
+        encode_polygons(pred["masks"], masks_dtype_for(pred["masks"], settings.MASKS_STORAGE_DTYPE))
+        encode_boxes(pred["boxes"])
+    with timed(timings, "draw"):
+        overlay = draw_prediction(image, pred["masks"], pred["num_classes"])
+    with timed(timings, "pdf"):
+        gen_pdf(pred, overlay)
+    return timings, pred["detected_objects"]
+
+
+def peak_rss_mb():
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def summarize(samples: list):
+    values = np.asarray(samples) * 1000
+    return {"p50_ms": round(float(np.percentile(values, 50)), 3),
+            "p99_ms": round(float(np.percentile(values, 99)), 3),
+            "mean_ms": round(float(values.mean()), 3)}
+
+
+async def bench_width(s3: StubS3, images: list, model, repeat: int, warmup: int):
+    keys = []
+    for idx, bytes_img in enumerate(images):
+        key = f"bench-{idx}.img"
+        await s3.put_object(Bucket=settings.S3_BUCKET_NAME_IMAGES, Key=key, Body=bytes_img)
+        keys.append(key)
+    for _ in range(warmup):
+        await run_once(s3, keys[0], model)
+
+    samples = {stage: [] for stage in STAGES + ("total",)}
+    detections = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for key in keys:
+            timings, detected = await run_once(s3, key, model)
+            for stage, seconds in timings.items():
+                samples[stage].append(seconds)
+            samples["total"].append(sum(timings.values()))
+            detections.append(detected)
+    wall = time.perf_counter() - started
+    s3.objects.clear()
+    return samples, detections, wall
+
+
+def load_fixtures(path: str):
+    files = sorted(p for p in Path(path).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"))
+    groups = {}
+    for file in files:
+        bytes_img = file.read_bytes()
+        height, width = decode_image(bytes_img).shape[:2]
+        groups.setdefault((height, width), []).append(bytes_img)
+    return sorted(groups.items(), key=lambda item: item[0][0] * item[0][1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(entry: dict):
+    print(f"\n{entry['width']}x{entry['height']}  images={entry['images']} runs={entry['runs']} "
+          f"detections={entry['detections']}  {entry['images_per_s']:.2f} img/s  "
+          f"{entry['megapixels_per_s']:.1f} MP/s  peak RSS {entry['peak_rss_mb']:.0f} MB")
+    print(f"  {'stage':<12}{'p50 ms':>10}{'p99 ms':>10}")
+    for stage, stats in entry["stages"].items():
+        print(f"  {stage:<12}{stats['p50_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+
+
+def print_comparison(results: list, baseline: dict):
+    print(f"\nvs baseline {baseline['meta'].get('commit') or '?'} (p50, ms)")
+    previous = {(entry["height"], entry["width"]): entry for entry in baseline["results"]}
+    for entry in results:
+        old = previous.get((entry["height"], entry["width"]))
+        if old is None:
+            continue
+        print(f"  {entry['width']}x{entry['height']}")
+        for stage, stats in entry["stages"].items():
+            if stage not in old["stages"]:
+                continue
+            before, after = old["stages"][stage]["p50_ms"], stats["p50_ms"]
+            ratio = before / after if after else float("inf")
+            print(f"    {stage:<12}{before:>10.1f} ->{after:>9.1f}  {ratio:5.2f}x")
+
+
+def main(args):
+    if args.weights:
+        from modelService.modelseg.backends import load_model
+        model, model_name = load_model(args.weights), args.weights
+    else:
+        model = StandInModel(args.imgsz, args.detections, args.points)
+        model_name = f"stand-in imgsz={args.imgsz} detections={args.detections} points={args.points}"
+
+    rng = np.random.default_rng(args.seed)
+    if args.fixtures:
+        groups = load_fixtures(args.fixtures)
+    else:
+        groups = [((args.height, width), [encode_image(synthetic_radiograph(args.height, width, rng), args.format)
+                                          for _ in range(args.images)])
+                  for width in sorted(args.widths)]
+
+    s3 = StubS3()
+    results = []
+    for (height, width), images in groups:
+        samples, detections, wall = asyncio.run(bench_width(s3, images, model, args.repeat, args.warmup))
+        runs = len(samples["total"])
+        entry = {
+            "height": height,
+            "width": width,
+            "images": len(images),
+            "runs": runs,
+            "detections": int(np.mean(detections)),
+            "images_per_s": round(runs / wall, 3),
+            "megapixels_per_s": round(runs * height * width / wall / 1e6, 3),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "stages": {stage: summarize(values) for stage, values in samples.items()},
+        }
+        results.append(entry)
+        print_report(entry)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "torch": torch.__version__,
+            "opencv": cv2.__version__,
+            "cpus": os.cpu_count(),
+            "model": model_name,
+            "format": args.format,
+            "settings": tiler_config(),
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved {args.json}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            print_comparison(results, json.load(f))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline /model/predict pipeline benchmark")
+    parser.add_argument("--widths", type=int, nargs="+", default=[4480, 8960, 17920])
+    parser.add_argument("--height", type=int, default=640)
+    parser.add_argument("--images", type=int, default=3, help="distinct synthetic images per width")
+    parser.add_argument("--repeat", type=int, default=5, help="passes over the images")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--format", choices=("jpg", "png"), default="jpg")
+    parser.add_argument("--fixtures", help="directory with real radiographs instead of synthetic ones")
+    parser.add_argument("--weights", help="real model weights instead of the stand-in network")
+    parser.add_argument("--imgsz", type=int, default=640, help="stand-in network input size")
+    parser.add_argument("--detections", type=int, default=5, help="stand-in detections per tile")
+    parser.add_argument("--points", type=int, default=200, help="vertices per stand-in mask")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare p50 with a previous --json file")
+    main(parser.parse_args())
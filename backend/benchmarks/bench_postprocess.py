@@ -0,0 +1,112 @@
+"""
+Микробенчмарк постобработки предсказаний: прежний цикл по каждой вершине
+против processed_prediction на общих NumPy-массивах.
+
+    python -m benchmarks.bench_postprocess --detections 20 --points 500 --repeat 5
+
+Результаты плиток синтетические (объекты с тем же интерфейсом, что у
+ultralytics Results), модель не нужна; нужен torch, как и самому сервису.
+"""
+import argparse
+import time
+import numpy as np
+import torch
+from configs.config import settings
+from modelService.modelseg.tiling import compute_windows
+from modelService.modelseg.utils import processed_prediction
+
+
+class FakeBoxes:
+    def __init__(self, xyxy, cls, conf):
+        self.xyxy, self.cls, self.conf = torch.from_numpy(xyxy), torch.from_numpy(cls), torch.from_numpy(conf)
+
+    def __len__(self):
+        return len(self.xyxy)
+
+
+class FakeMasks:
+    def __init__(self, xy):
+        self.xy = xy
+
+
+class FakeResult:
+    names = {0: "pore", 1: "crack", 2: "inclusion"}
+
+    def __init__(self, boxes, masks):
+        self.boxes, self.masks = boxes, masks
+
+
+def make_results(windows: np.ndarray, detections: int, points: int, rng: np.random.Generator):
+    results = []
+    for x0, y0, x1, y1 in windows:
+        w, h = x1 - x0, y1 - y0
+        centers = rng.uniform((10, 10), (w - 10, h - 10), size=(detections, 2)).astype(np.float32)
+        radius = rng.uniform(2, 8, size=(detections, 1)).astype(np.float32)
+        angles = np.linspace(0, 2 * np.pi, points, endpoint=False, dtype=np.float32)
+        circle = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+        xy = [center + r * circle for center, r in zip(centers, radius)]
+        xyxy = np.concatenate([centers - radius, centers + radius], axis=1)
+        cls = rng.integers(0, 3, size=detections).astype(np.float32)
+        conf = rng.uniform(0.3, 1.0, size=detections).astype(np.float32)
+        results.append(FakeResult(FakeBoxes(xyxy, cls, conf), FakeMasks(xy)))
+    return results
+
+
+def processed_prediction_loop(result: list, windows: np.ndarray):
+    """Прежняя реализация: сдвиг и перевод в float для каждой вершины отдельно."""
+    masks_global, boxes_global = [], []
+    classes, class_ids, confs = [], [], []
+    for idx, det in enumerate(result):
+        shift_x, shift_y = windows[idx, :2].tolist()
+        if det.masks is not None:
+            for mask in det.masks.xy:
+                masks_global.append([[float(pt[0] + shift_x), float(pt[1] + shift_y)] for pt in mask])
+        if det.boxes is not None:
+            for box in det.boxes.xyxy:
+                x1, y1, x2, y2 = box.tolist()
+                boxes_global.append([float(x1 + shift_x), float(y1 + shift_y), float(x2 + shift_x), float(y2 + shift_y)])
+            classes.extend([det.names[c] for c in det.boxes.cls.tolist()])
+            class_ids.extend(det.boxes.cls.tolist())
+            confs.extend(det.boxes.conf.tolist())
+    return {"masks": masks_global, "boxes": boxes_global, "classes": classes, "num_classes": class_ids, "confs": confs}
+
+
+def timeit(fn, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(args):
+    settings.MASK_SIMPLIFY_TOLERANCE = args.simplify
+    settings.MASK_ROUND = args.decimals is not None
+    if args.decimals is not None:
+        settings.MASK_DECIMALS = args.decimals
+
+    windows = compute_windows(args.height, args.width)
+    results = make_results(windows, args.detections, args.points, np.random.default_rng(0))
+    total_points = len(windows) * args.detections * args.points
+    print(f"tiles={len(windows)} detections={len(windows) * args.detections} points={total_points}")
+
+    loop = timeit(lambda: processed_prediction_loop(results, windows), args.repeat)
+    vectorized = timeit(lambda: processed_prediction(results, windows, args.height, args.width), args.repeat)
+    pred = processed_prediction(results, windows, args.height, args.width)
+    points_out = sum(len(mask) for mask in pred["masks"])
+
+    print(f"per-vertex loop: {loop * 1000:.1f} ms")
+    print(f"vectorized:      {vectorized * 1000:.1f} ms ({loop / vectorized:.1f}x), points out={points_out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="processed_prediction microbenchmark")
+    parser.add_argument("--height", type=int, default=640)
+    parser.add_argument("--width", type=int, default=17920)
+    parser.add_argument("--detections", type=int, default=20, help="detections per tile")
+    parser.add_argument("--points", type=int, default=500, help="vertices per mask")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--simplify", type=float, default=0.0, help="Douglas-Peucker tolerance, px")
+    parser.add_argument("--decimals", type=int, default=None, help="round coordinates to N decimals")
+    main(parser.parse_args())
@@ -0,0 +1,24 @@
+"""Синтетические рентгенограммы шва для бенчмарков и нагрузочных тестов."""
+import cv2
+import numpy as np
+
+
+def synthetic_radiograph(height: int, width: int, rng: np.random.Generator):
+    """Полоса шва с зерном плёнки и тёмными порами/трещинами — похожая на снимок статистика для JPEG и PNG."""
+    y = np.linspace(-1, 1, height, dtype=np.float32)[:, None]
+    seam = 150 - 60 * np.exp(-(y / 0.35) ** 2)
+    image = np.broadcast_to(seam, (height, width)).copy()
+    image += rng.normal(0, 6, size=(height, width)).astype(np.float32)
+    for _ in range(max(1, width // 300)):
+        center = (int(rng.integers(0, width)), int(rng.integers(height // 4, 3 * height // 4)))
+        axes = (int(rng.integers(2, 40)), int(rng.integers(2, 8)))
+        cv2.ellipse(image, center, axes, float(rng.uniform(0, 180)), 0, 360, float(rng.uniform(40, 90)), -1)
+    image = cv2.GaussianBlur(np.clip(image, 0, 255).astype(np.uint8), (3, 3), 0)
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+
+def encode_image(image: np.ndarray, fmt: str):
+    ok, buffer = cv2.imencode(f".{fmt}", image)
+    if not ok:
+        raise ValueError(f"Failed to encode {fmt}")
+    return buffer.tobytes()
@@ -3,28 +3,39 @@ import os
 from fastapi import FastAPI
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
-from dbmodels.database import engine, Base
+from dbmodels.database import engine, Base, start_s3_client, stop_s3_client
+from dbmodels.migrations import run_migrations
 from .client.router import router as client_router
 from .files.router import router as files_router
 from configs.config import settings
+from common.compression import CompressionMiddleware
+from common.metrics import setup_metrics
+from common.responses import JSONResponse
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     os.makedirs(".."+settings.FILE_SAVE_FOLDER, exist_ok=True)
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(conn)
+    await start_s3_client()
     yield
-    pass
+    await stop_s3_client()
+    await engine.dispose()
 
-app = FastAPI(title="ClientService", lifespan=lifespan)
+app = FastAPI(title="ClientService", lifespan=lifespan, default_response_class=JSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins = settings.HOSTS,
     allow_methods = settings.METHODS,
     allow_headers = settings.HEADERS,
-    allow_credentials=settings.CREDENTIALS
+    allow_credentials=settings.CREDENTIALS,
+    expose_headers=[settings.REQUEST_ID_HEADER]
 )
+if settings.RESPONSE_COMPRESSION:
+    app.add_middleware(CompressionMiddleware)
+setup_metrics(app)
 
 app.include_router(client_router, tags=["client"], prefix="/client")
 app.include_router(files_router, tags=["file"], prefix="/client/file")
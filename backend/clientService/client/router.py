@@ -1,10 +1,14 @@
 import uuid
 from fastapi import APIRouter, Depends, Query, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
+from common.responses import JSONResponse
 from authService.auth.utils import get_current_user
 from dbmodels.crud import get_history_by_user_file_id, get_history_by_user_id_per_page
+from configs.config import settings
 from dbmodels.database import db_dependency
-from dbmodels.schemas import HistoryIdResponseDB, HistorFullResponseDB, UserBase
+from dbmodels.codecs import BINARY_MEDIA_TYPE, pack_prediction
+from dbmodels.schemas import HistoryIdResponseDB, UserBase
+from .utils import decode_cursor, encode_cursor
 
 router = APIRouter()
 
@@ -24,14 +28,23 @@ async def personal_account(user: UserBase = Depends(get_current_user)):
     )
 
 @router.get("/history")
-async def history(page: int = Query(ge=0, default=0), user: UserBase = Depends(get_current_user), db: db_dependency=db_dependency):
+async def history(page: int = Query(ge=0, default=0), cursor: str = Query(default=None), user: UserBase = Depends(get_current_user), db: db_dependency=db_dependency):
     if user is None or not user.is_active:
         return JSONResponse(
             status_code=401,
             content={"message": "You are not authenticated"},
         )
     
-    db_history, total = await get_history_by_user_id_per_page(id=user.id, page=page, db=db)
+    keyset = None
+    if cursor is not None:
+        keyset = decode_cursor(cursor)
+        if keyset is None:
+            return JSONResponse(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content={"message": "Invalid cursor"},
+            )
+
+    db_history, total, has_next = await get_history_by_user_id_per_page(id=user.id, page=page, db=db, cursor=keyset)
     historys = [HistoryIdResponseDB.model_validate(item) for item in db_history]
 
     response = [
@@ -49,15 +62,17 @@ async def history(page: int = Query(ge=0, default=0), user: UserBase = Depends(g
             content={"message": "You have no history"},
         )
     
+    last = db_history[-1]
     return JSONResponse(
         status_code=status.HTTP_200_OK,
         content={"message": response,
                  "page":page,
-                 "total_pages":total},
+                 "total_pages":total,
+                 "next_cursor": encode_cursor(last.created_at, last.id) if has_next else None},
     )
 
 @router.get("/history/{file_id}")
-async def history(file_id: str, user: UserBase = Depends(get_current_user), db: db_dependency = db_dependency):
+async def history(file_id: str, format: str = Query(default="json", pattern="^(json|binary)$"), user: UserBase = Depends(get_current_user), db: db_dependency = db_dependency):
     if user is None or not user.is_active:
         return JSONResponse(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -71,22 +86,35 @@ async def history(file_id: str, user: UserBase = Depends(get_current_user), db:
             content={"message": "You have no history"},
         )
     
-    history = HistorFullResponseDB.model_validate(db_history)
-    ind_cls = {int(i):v for i,v in zip(history.num_classes, history.classes)}
+    # Геометрия не проходит через HistorFullResponseDB: валидация сотен
+    # тысяч координат pydantic'ом дороже самого ответа
+    history = HistoryIdResponseDB.model_validate(db_history)
+    ind_cls = {int(i):v for i,v in zip(db_history.num_classes, db_history.classes)}
     response = {
         "user_id": str(history.user_id),
         "file_id": str(history.file_id),
-        "masks": history.masks,
-        "boxes": history.boxes,
-        "classes": history.classes,
-        "num_classes": history.num_classes,
-        "confs": history.confs,
+        "classes": db_history.classes,
+        "num_classes": db_history.num_classes,
+        "confs": db_history.confs,
         "ind_cls": ind_cls,
-        "path_to_report": history.path_to_report,
+        # Пока воркер не построил PDF, ссылка ведёт на /model/report, который его отдаст
+        "path_to_report": db_history.path_to_report or f"{settings.REPORT_PUBLIC_URL}/{history.file_id}",
         "created_at": history.created_at.strftime("%d.%m.%Y %H:%M:%S"),
         "updated_at": history.updated_at.strftime("%d.%m.%Y %H:%M:%S"),
+        # Точное значение для PATCH /model/update_predict/detections
+        "version": history.updated_at.isoformat(),
+        "detection_ids": db_history.detection_ids,
     }
 
+    if format == "binary" and db_history.masks_bin is not None:
+        return Response(
+            status_code=status.HTTP_200_OK,
+            content=pack_prediction(db_history.masks_bin, db_history.boxes_bin, db_history.masks_dtype, response),
+            media_type=BINARY_MEDIA_TYPE
+        )
+
+    response["masks"] = db_history.masks
+    response["boxes"] = db_history.boxes
     return JSONResponse(
         status_code=status.HTTP_200_OK, 
         content=response
@@ -0,0 +1,14 @@
+import base64
+from datetime import datetime
+import uuid
+
+def encode_cursor(created_at: datetime, id: uuid.UUID):
+    raw = f"{created_at.isoformat()}|{id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), uuid.UUID(id)
+    except Exception:
+        return None
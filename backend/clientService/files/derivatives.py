@@ -0,0 +1,147 @@
+import asyncio
+import math
+import uuid
+import cv2
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from common.metrics import stage
+from configs.config import settings
+from dbmodels.crud import change_file_derivatives
+from dbmodels.database import async_session_maker
+
+# Производные оригинала лежат в том же бакете рядом с ним:
+#   <stem>_thumb.jpg, <stem>_preview.jpg — уменьшенные копии по длинной стороне
+#   <stem>.dzi + <stem>_files/<level>/<col>_<row>.jpg — пирамида DeepZoom
+# (её читают OpenSeadragon и совместимые вьюеры).
+DZI_TEMPLATE = ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="jpg" Overlap="{overlap}" TileSize="{tile_size}">'
+                '<Size Width="{width}" Height="{height}"/></Image>')
+
+_IN_FLIGHT = {}
+
+
+def public_url(key: str):
+    return settings.S3_PUBLIC_URL + "/" + settings.S3_BUCKET_NAME_IMAGES + "/" + key
+
+
+def file_derivatives(db_file):
+    return {
+        "width": db_file.width,
+        "height": db_file.height,
+        "thumbnail": db_file.thumbnail_url,
+        "preview": db_file.preview_url,
+        "dzi": db_file.dzi_url,
+    }
+
+
+def _encode_jpg(image: np.ndarray):
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, settings.DERIVATIVES_JPEG_QUALITY])
+    if not ok:
+        raise ValueError("Не удалось закодировать изображение")
+    return buffer.tobytes()
+
+
+def _fit(image: np.ndarray, size: int):
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+
+def _pyramid_tiles(image: np.ndarray, stem: str):
+    tile_size, overlap = settings.DZI_TILE_SIZE, settings.DZI_TILE_OVERLAP
+    height, width = image.shape[:2]
+    max_level = math.ceil(math.log2(max(height, width, 1)))
+
+    # Уровни строятся сверху вниз: каждый следующий — вдвое меньше предыдущего
+    level_image = image
+    for level in range(max_level, -1, -1):
+        level_height, level_width = level_image.shape[:2]
+        for row in range(math.ceil(level_height / tile_size)):
+            y0 = max(0, row * tile_size - overlap)
+            y1 = min(level_height, (row + 1) * tile_size + overlap)
+            for col in range(math.ceil(level_width / tile_size)):
+                x0 = max(0, col * tile_size - overlap)
+                x1 = min(level_width, (col + 1) * tile_size + overlap)
+                yield f"{stem}_files/{level}/{col}_{row}.jpg", _encode_jpg(level_image[y0:y1, x0:x1])
+        if level:
+            size = (math.ceil(level_width / 2), math.ceil(level_height / 2))
+            level_image = cv2.resize(level_image, size, interpolation=cv2.INTER_AREA)
+
+
+def build_derivatives(bytes_img: bytes, stem: str):
+    """Возвращает (width, height, [(key, body, content_type), ...])."""
+    image = cv2.imdecode(np.frombuffer(bytes_img, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Не удалось декодировать изображение")
+    height, width = image.shape[:2]
+
+    objects = [
+        (f"{stem}_thumb.jpg", _encode_jpg(_fit(image, settings.THUMBNAIL_SIZE)), "image/jpeg"),
+        (f"{stem}_preview.jpg", _encode_jpg(_fit(image, settings.PREVIEW_SIZE)), "image/jpeg"),
+        (f"{stem}.dzi", DZI_TEMPLATE.format(overlap=settings.DZI_TILE_OVERLAP, tile_size=settings.DZI_TILE_SIZE,
+                                            width=width, height=height).encode(), "application/xml"),
+    ]
+    objects.extend((key, body, "image/jpeg") for key, body in _pyramid_tiles(image, stem))
+    return width, height, objects
+
+
+async def _download(s3, key: str):
+    response = await s3.get_object(Bucket=settings.S3_BUCKET_NAME_IMAGES, Key=key)
+    async with response["Body"] as stream:
+        return await stream.read()
+
+
+async def generate_derivatives(s3, file_id: uuid.UUID, path_to_file: str):
+    key = path_to_file.rsplit("/", 1)[-1]
+    stem = key.rsplit(".", 1)[0]
+    bytes_img = await _download(s3, key)
+    with stage("derivatives"):
+        width, height, objects = await run_in_threadpool(build_derivatives, bytes_img, stem)
+    del bytes_img
+
+    semaphore = asyncio.Semaphore(settings.DERIVATIVES_CONCURRENCY)
+
+    async def put(key, body, content_type):
+        async with semaphore:
+            await s3.put_object(
+                Bucket=settings.S3_BUCKET_NAME_IMAGES,
+                Key=key,
+                Body=body,
+                ContentLength=len(body),
+                ContentType=content_type,
+                ACL='public-read'
+            )
+
+    await asyncio.gather(*(put(*obj) for obj in objects))
+
+    derivatives = {
+        "width": width,
+        "height": height,
+        "thumbnail_url": public_url(f"{stem}_thumb.jpg"),
+        "preview_url": public_url(f"{stem}_preview.jpg"),
+        "dzi_url": public_url(f"{stem}.dzi"),
+    }
+    async with async_session_maker() as db:
+        await change_file_derivatives(file_id, derivatives, db)
+    return derivatives
+
+
+async def ensure_derivatives(s3, file_id: uuid.UUID, path_to_file: str):
+    """Одна генерация на файл, даже если её одновременно ждут загрузка и несколько запросов."""
+    task = _IN_FLIGHT.get(file_id)
+    if task is None:
+        task = asyncio.create_task(generate_derivatives(s3, file_id, path_to_file))
+        _IN_FLIGHT[file_id] = task
+        task.add_done_callback(lambda _: _IN_FLIGHT.pop(file_id, None))
+    return await asyncio.shield(task)
+
+
+async def generate_derivatives_for_files(s3, files: list):
+    """Фоновая задача после загрузки: files — список (file_id, path_to_file)."""
+    for file_id, path_to_file in files:
+        try:
+            await ensure_derivatives(s3, file_id, path_to_file)
+        except Exception as e:
+            print(e)
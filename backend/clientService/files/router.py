@@ -1,12 +1,16 @@
+import asyncio
 from typing import List
 import uuid
 from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, status
-from fastapi.responses import JSONResponse
+from common.metrics import stage
+from common.responses import JSONResponse
 from authService.auth.utils import get_current_user
 from dbmodels.schemas import UserBase
 from configs.config import settings
-from dbmodels.database import db_dependency, s3_dependency
-from dbmodels.crud import create_file, find_file_by_id
+from dbmodels.database import db_dependency, release_connection, s3_dependency
+from dbmodels.crud import create_files, get_file_by_id
+from .derivatives import ensure_derivatives, file_derivatives, generate_derivatives_for_files
+from .utils import delete_uploaded, upload_file
 
 router = APIRouter()    
 
@@ -19,8 +23,8 @@ async def get_path_file(file_id: str, background_tasks: BackgroundTasks, user: U
         )
     
     file_id = uuid.UUID(file_id)
-    path_to_image = await find_file_by_id(id=file_id, db=db)
-    if path_to_image is None:
+    db_file = await get_file_by_id(id=file_id, db=db)
+    if db_file is None:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content={"path": "We didn`t find file"}
@@ -28,63 +32,68 @@ async def get_path_file(file_id: str, background_tasks: BackgroundTasks, user: U
 
     return JSONResponse(
         status_code=status.HTTP_200_OK,
-        content={"path": path_to_image}
+        content={"path": db_file.path_to_file, **file_derivatives(db_file)}
     )
 
-@router.post("/")
-async def files_upload(background_tasks: BackgroundTasks, files: List[UploadFile], user: UserBase = Depends(get_current_user), db: db_dependency = db_dependency, s3: s3_dependency = s3_dependency):
+@router.get("/{file_id}/derivatives")
+async def get_file_derivatives(file_id: str, user: UserBase = Depends(get_current_user), db: db_dependency = db_dependency, s3: s3_dependency = s3_dependency):
     if user is None or not user.is_active:
         return JSONResponse(
             status_code=status.HTTP_401_UNAUTHORIZED,
             content={"message": "You are not authenticated"},
         )
 
-    file_ids = []
-    for file in files:
-        if file.content_type.split('/')[1] not in settings.APPLYLOADFORMATFILE:
-            return JSONResponse(
-                status_code=status.HTTP_404_NOT_FOUND,
-                content={
-                    "message": f"Oops! This file {file.filename} is invalid file type, you can upload file with types: {', '.join(settings.APPLYLOADFORMATFILE)}"},
-            )
-        
-        #path_to_image = await save_file(file=file)
+    db_file = await get_file_by_id(id=uuid.UUID(file_id), db=db)
+    if db_file is None or db_file.file_id != user.id:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": "We didn`t find file"}
+        )
 
-        contents = await file.read()
-        path_to_image = f"{uuid.uuid4().hex + '.' + file.filename.split('.')[-1].lower()}"
+    # Файлы, загруженные до появления производных, получают их при первом обращении
+    if db_file.dzi_url is None:
+        await release_connection(db)
+        derivatives = await ensure_derivatives(s3, db_file.id, db_file.path_to_file)
+        for column, value in derivatives.items():
+            setattr(db_file, column, value)
 
-        try:
-            resp = await s3.put_object(
-                Bucket=settings.S3_BUCKET_NAME_IMAGES,
-                Key=path_to_image,
-                Body=contents,
-                ContentLength=len(contents),
-                ContentType=file.content_type,
-                ACL='public-read'
-            )
-            await s3.close()
-        except Exception as e:
-            print(e)
-            return JSONResponse(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                content={
-                    "message": f"Oops! This file {file.filename} is bad. We can`t upload this file, please try upload again or change this file."},
-            )
-        
-        url = settings.S3_PUBLIC_URL + "/" + settings.S3_BUCKET_NAME_IMAGES + "/" + path_to_image
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content=file_derivatives(db_file)
+    )
 
-        # if path_to_image is None:
-        #     return JSONResponse(
-        #         status_code=status.HTTP_400_BAD_REQUEST,
-        #         content={
-        #             "message": f"Oops! This file {file.filename} is bad. We can`t upload this file, please try upload again or change this file."},
-        #     )
+@router.post("/")
+async def files_upload(background_tasks: BackgroundTasks, files: List[UploadFile], user: UserBase = Depends(get_current_user), db: db_dependency = db_dependency, s3: s3_dependency = s3_dependency):
+    if user is None or not user.is_active:
+        return JSONResponse(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={"message": "You are not authenticated"},
+        )
+
+    semaphore = asyncio.Semaphore(settings.UPLOAD_CONCURRENCY)
+    with stage("upload"):
+        results = await asyncio.gather(*(upload_file(s3, file, semaphore) for file in files))
+
+    keys = [key for key, _ in results if key is not None]
+    errors = [{"filename": file.filename, "message": error} for file, (_, error) in zip(files, results) if error is not None]
+    if not keys:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"files": [], "errors": errors}
+        )
 
-        result = await create_file(path_to_file=url, user=user, db=db)
+    urls = [settings.S3_PUBLIC_URL + "/" + settings.S3_BUCKET_NAME_IMAGES + "/" + key for key in keys]
+    try:
+        file_ids = await create_files(paths_to_files=urls, user=user, db=db)
+    except Exception:
+        # Без строк в БД загруженные объекты никому не доступны
+        await delete_uploaded(s3, keys)
+        raise
 
-        file_ids.append(result.id.__str__())
+    if settings.DERIVATIVES_ON_UPLOAD:
+        background_tasks.add_task(generate_derivatives_for_files, s3, list(zip(file_ids, urls)))
 
     return JSONResponse(
         status_code=status.HTTP_200_OK,
-        content={"files": file_ids}
+        content={"files": [file_id.__str__() for file_id in file_ids], "errors": errors}
     )
@@ -1,3 +1,4 @@
+import asyncio
 import uuid
 import aiofiles
 from fastapi import UploadFile
@@ -16,4 +17,82 @@ async def save_file(file: UploadFile):
         return None
     finally:
         await file.close()
-    return path_to_image
\ No newline at end of file
+    return path_to_image
+
+def is_allowed_file(file: UploadFile):
+    content_type = file.content_type or ""
+    return content_type.split('/')[-1] in settings.APPLYLOADFORMATFILE
+
+async def stream_to_s3(s3, file: UploadFile, key: str):
+    """
+    Загружает UploadFile в S3 частями по S3_UPLOAD_PART_SIZE, так что в памяти
+    одновременно лежит не больше одной части. Файлы меньше одной части уходят
+    обычным put_object, остальные — multipart upload, который при ошибке
+    отменяется.
+    """
+    part_size = settings.S3_UPLOAD_PART_SIZE
+    chunk = await file.read(part_size)
+    if len(chunk) < part_size:
+        await s3.put_object(
+            Bucket=settings.S3_BUCKET_NAME_IMAGES,
+            Key=key,
+            Body=chunk,
+            ContentLength=len(chunk),
+            ContentType=file.content_type,
+            ACL='public-read'
+        )
+        return
+
+    upload = await s3.create_multipart_upload(
+        Bucket=settings.S3_BUCKET_NAME_IMAGES,
+        Key=key,
+        ContentType=file.content_type,
+        ACL='public-read'
+    )
+    upload_id = upload["UploadId"]
+    parts = []
+    try:
+        while chunk:
+            part_number = len(parts) + 1
+            resp = await s3.upload_part(
+                Bucket=settings.S3_BUCKET_NAME_IMAGES,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=chunk,
+                ContentLength=len(chunk)
+            )
+            parts.append({"ETag": resp["ETag"], "PartNumber": part_number})
+            chunk = await file.read(part_size)
+        await s3.complete_multipart_upload(
+            Bucket=settings.S3_BUCKET_NAME_IMAGES,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts}
+        )
+    except BaseException:
+        await s3.abort_multipart_upload(Bucket=settings.S3_BUCKET_NAME_IMAGES, Key=key, UploadId=upload_id)
+        raise
+
+async def upload_file(s3, file: UploadFile, semaphore: asyncio.Semaphore):
+    """Возвращает (key, None) при успехе или (None, сообщение об ошибке)."""
+    if not is_allowed_file(file):
+        return None, f"Oops! This file {file.filename} is invalid file type, you can upload file with types: {', '.join(settings.APPLYLOADFORMATFILE)}"
+
+    key = f"{uuid.uuid4().hex + '.' + file.filename.split('.')[-1].lower()}"
+    async with semaphore:
+        try:
+            await stream_to_s3(s3, file, key)
+        except Exception as e:
+            print(e)
+            return None, f"Oops! This file {file.filename} is bad. We can`t upload this file, please try upload again or change this file."
+        finally:
+            await file.close()
+    return key, None
+
+async def delete_uploaded(s3, keys: list):
+    if keys:
+        await s3.delete_objects(
+            Bucket=settings.S3_BUCKET_NAME_IMAGES,
+            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True}
+        )
@@ -0,0 +1,223 @@
+"""
+Метрики Prometheus и сквозной request id для всех сервисов.
+
+Каждый запрос получает id из заголовка X-Request-ID (или новый); он хранится
+в contextvar, поэтому доступен в фоновых задачах, asyncio-задачах и пуле
+потоков, возвращается клиентом в ответе и передаётся воркеру отчётов через
+очередь report_jobs. Этапы конвейера замеряются stage(): время пишется
+в гистограмму, а при TRACE_SPANS ещё и печатается с request id.
+
+Без prometheus_client метрики превращаются в заглушки, /metrics не подключается.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+import uuid
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from configs.config import settings
+
+try:
+    import prometheus_client
+except ImportError:  # метрики необязательны
+    prometheus_client = None
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, value=1):
+        pass
+
+    def dec(self, value=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def set_function(self, fn):
+        pass
+
+
+def _metric(kind: str, name: str, documentation: str, labels=(), **kwargs):
+    if prometheus_client is None or not settings.METRICS_ENABLED:
+        return _NoopMetric()
+    return getattr(prometheus_client, kind)(name, documentation, labels, **kwargs)
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_SECONDS = _metric("Histogram", "http_request_duration_seconds", "HTTP request latency",
+                          ("method", "route", "status"), buckets=LATENCY_BUCKETS)
+REQUESTS_IN_PROGRESS = _metric("Gauge", "http_requests_in_progress", "HTTP requests being processed")
+STAGE_SECONDS = _metric("Histogram", "pipeline_stage_duration_seconds",
+                        "Latency of pipeline stages (download, decode, split, predict, postprocess, db, pdf)",
+                        ("stage",), buckets=LATENCY_BUCKETS)
+STAGE_ERRORS = _metric("Counter", "pipeline_stage_errors_total", "Pipeline stages that raised", ("stage",))
+
+INFERENCE_QUEUE_DEPTH = _metric("Gauge", "inference_queue_depth", "Requests waiting for the batch scheduler")
+INFERENCE_POOL_PENDING = _metric("Gauge", "inference_pool_pending", "Batches running or queued in the inference pool")
+BATCH_TILES = _metric("Histogram", "inference_batch_tiles", "Tiles per model batch",
+                      buckets=(1, 2, 4, 8, 16, 28, 32, 56, 64, 112, 128))
+BATCH_REQUESTS = _metric("Histogram", "inference_batch_requests", "Requests merged into one model batch",
+                         buckets=(1, 2, 3, 4, 6, 8, 12, 16))
+PREDICT_CACHE = _metric("Counter", "predict_cache_requests_total", "Prediction cache lookups", ("result",))
+JOBS_ACTIVE = _metric("Gauge", "predict_jobs_active", "Prediction jobs being processed")
+REPORT_JOBS_RUNNING = _metric("Gauge", "report_jobs_running", "Report jobs being rendered by this worker")
+REPORT_JOBS = _metric("Counter", "report_jobs_total", "Finished report jobs", ("result",))
+
+DB_QUERY_SECONDS = _metric("Histogram", "db_query_duration_seconds", "SQL statement latency",
+                           buckets=LATENCY_BUCKETS)
+DB_POOL_SIZE = _metric("Gauge", "db_pool_size", "Connections kept in the SQLAlchemy pool")
+DB_POOL_CHECKED_OUT = _metric("Gauge", "db_pool_checked_out", "Pool connections in use")
+DB_POOL_OVERFLOW = _metric("Gauge", "db_pool_overflow", "Connections opened above pool_size")
+S3_REQUEST_SECONDS = _metric("Histogram", "s3_request_duration_seconds", "S3 API call latency",
+                             ("operation", "status"), buckets=LATENCY_BUCKETS)
+
+
+REQUEST_ID: ContextVar[str] = ContextVar("request_id", default=None)
+
+
+def current_request_id():
+    return REQUEST_ID.get()
+
+
+def new_request_id():
+    return uuid.uuid4().hex
+
+
+@contextmanager
+def request_context(request_id: str = None):
+    """Выставляет request id (например, для задачи воркера) на время блока."""
+    token = REQUEST_ID.set(request_id or new_request_id())
+    try:
+        yield REQUEST_ID.get()
+    finally:
+        REQUEST_ID.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    """Замеряет этап конвейера; работает и в корутинах, и в пуле потоков."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        if settings.TRACE_SPANS:
+            print(f"[{current_request_id() or '-'}] {name} {elapsed * 1000:.1f} ms")
+
+
+class RequestContextMiddleware:
+    """
+    ASGI-middleware: request id из X-Request-ID (или новый) в contextvar
+    и в заголовок ответа, латентность запроса по шаблону маршрута.
+    Фоновые задачи Starlette выполняются внутри вызова приложения,
+    поэтому тоже видят request id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.header = settings.REQUEST_ID_HEADER
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = Headers(scope=scope).get(self.header) or new_request_id()
+        # Чужой id попадает в логи и метки трассировки — ограничиваем его длину
+        request_id = request_id[:64]
+        token = REQUEST_ID.set(request_id)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message)[self.header] = request_id
+            await send(message)
+
+        REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            REQUESTS_IN_PROGRESS.dec()
+            if scope["path"] != "/metrics":
+                # Шаблон пути, а не сам путь: иначе uuid файлов раздувают число серий
+                route = getattr(scope.get("route"), "path", None) or "unmatched"
+                REQUEST_SECONDS.labels(scope["method"], route, str(status_code)).observe(time.perf_counter() - started)
+            REQUEST_ID.reset(token)
+
+
+async def metrics_endpoint(request):
+    return Response(prometheus_client.generate_latest(), media_type=prometheus_client.CONTENT_TYPE_LATEST)
+
+
+def setup_metrics(app):
+    """Подключает request id ко всем запросам и /metrics, если доступен prometheus_client."""
+    app.add_middleware(RequestContextMiddleware)
+    if prometheus_client is not None and settings.METRICS_ENABLED:
+        app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
+
+def start_metrics_server(port: int):
+    """/metrics для процессов без HTTP-приложения (воркер отчётов)."""
+    if prometheus_client is not None and settings.METRICS_ENABLED and port:
+        prometheus_client.start_http_server(port)
+
+
+def instrument_engine(engine):
+    """Латентность SQL-запросов и заполненность пула соединений SQLAlchemy."""
+    from sqlalchemy import event
+
+    pool = engine.pool
+    DB_POOL_SIZE.set_function(pool.size)
+    DB_POOL_CHECKED_OUT.set_function(pool.checkedout)
+    DB_POOL_OVERFLOW.set_function(lambda: max(0, pool.overflow()))
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERY_SECONDS.observe(time.perf_counter() - conn.info["query_started"].pop())
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+
+def instrument_s3(client):
+    """
+    Латентность вызовов S3 по операциям через события botocore; для get_object —
+    до получения заголовков, чтение тела замеряется этапом download.
+    """
+    events = client.meta.events
+
+    def before_call(model, context, **kwargs):
+        context["metrics_call"] = (model.name, time.perf_counter())
+
+    def after_call(context, http_response=None, **kwargs):
+        # after-call-error (обрыв соединения, таймаут) приходит без http_response
+        call = context.pop("metrics_call", None)
+        if call is not None:
+            operation, started = call
+            status = http_response.status_code if http_response is not None else "error"
+            S3_REQUEST_SECONDS.labels(operation, str(status)).observe(time.perf_counter() - started)
+
+    events.register("before-call.s3", before_call)
+    events.register("after-call.s3", after_call)
+    events.register("after-call-error.s3", after_call)
@@ -0,0 +1,46 @@
+import json
+import numpy as np
+from starlette.responses import JSONResponse as StarletteJSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен: без него работает stdlib json
+    orjson = None
+
+# Плоские numpy-массивы и скаляры orjson пишет сам (OPT_SERIALIZE_NUMPY),
+# остальное (uuid, datetime, неконтигуальные массивы) приводится здесь.
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def _default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def json_dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, default=_default,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def json_loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class JSONResponse(StarletteJSONResponse):
+    """
+    Замена fastapi.responses.JSONResponse: сериализация через orjson
+    (в разы быстрее stdlib json на вложенных списках координат) и поддержка
+    numpy-массивов в content. Используется как default_response_class сервисов.
+    """
+
+    def render(self, content) -> bytes:
+        return json_dumps(content)
@@ -7,7 +7,15 @@ class Settings(BaseSettings):
     POSTGRES_HOST: str = ""
     POSTGRES_PORT: int = 0
     POSTGRES_DB: str = ""
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int = 100
     LIMIT_ITEMS_PER_PAGE: int = 0
+    MASKS_STORAGE_DTYPE: str = "float32"
 
     #S3
     S3_SERVICE_NAME: str = ""
@@ -18,9 +26,52 @@ class Settings(BaseSettings):
     S3_BUCKET_NAME_IMAGES: str = ""
     S3_BUCKET_NAME_PDF: str = ""
     S3_PUBLIC_URL: str = ""
+    S3_MAX_POOL_CONNECTIONS: int = 50
+    S3_KEEPALIVE_TIMEOUT: int = 60
+    S3_READ_CHUNK_SIZE: int = 1024 * 1024
+    S3_UPLOAD_PART_SIZE: int = 8 * 1024 * 1024
+    UPLOAD_CONCURRENCY: int = 4
 
     # Model Segmentation
     PATHTOMODEL: str = ""
+    INFERENCE_BACKEND: str = "torch"
+    INFERENCE_PRECISION: str = "fp32"
+    INFERENCE_CALIBRATION_DATA: str = ""
+    INFERENCE_PARITY_CHECK: bool = False
+    INFERENCE_PARITY_TOLERANCE: float = 0.05
+
+    # Inference pool
+    INFERENCE_WORKERS: int = 1
+    INFERENCE_QUEUE_SIZE: int = 8
+    INFERENCE_INTRA_OP_THREADS: int = 0
+    INFERENCE_INTER_OP_THREADS: int = 0
+    INFERENCE_RETRY_AFTER: int = 5
+    BATCH_MAX_TILES: int = 64
+    BATCH_MAX_WAIT_MS: float = 10.0
+    WARMUP_RUNS: int = 2
+    WARMUP_IMAGE_HEIGHT: int = 640
+    WARMUP_IMAGE_WIDTH: int = 17920
+
+    # Prediction cache
+    PREDICT_CACHE_ENABLED: bool = True
+    PREDICT_CACHE_MAX_MB: int = 256
+    PREDICT_CACHE_DIR: str = "./cache/predictions"
+    PREDICT_CACHE_DISK_MAX_MB: int = 2048
+
+    # Prediction jobs
+    JOB_FILE_CONCURRENCY: int = 4
+    JOB_TTL_SECONDS: int = 3600
+
+    # Reports
+    REPORT_PUBLIC_URL: str = "http://localhost:8003/model/report"
+    REPORT_EAGER: bool = True
+    REPORT_WORKER_CONCURRENCY: int = 2
+    REPORT_POLL_INTERVAL: float = 2.0
+    REPORT_MAX_ATTEMPTS: int = 3
+    REPORT_RETRY_DELAY: int = 30
+    REPORT_LOCK_TIMEOUT: int = 600
+    REPORT_WAIT_SECONDS: int = 20
+    REPORT_DPI: int = 150
 
     # Images
     APPLYLOADFORMATFILE: list = ["png", "jpeg"]
@@ -29,10 +80,52 @@ class Settings(BaseSettings):
     GRID_ROWS: int = 1
     GRID_COLS: int = 28
 
+    # Tiling
+    TILE_HEIGHT: int = 0
+    TILE_WIDTH: int = 0
+    TILE_OVERLAP: int = 0
+    TILE_EDGE_POLICY: str = "shift"
+    TILE_NMS_IOU: float = 0.5
+    TILE_STITCH: bool = True
+    TILE_STITCH_TOLERANCE: float = 2.0
+
+    # Post-processing
+    MASK_SIMPLIFY_TOLERANCE: float = 0.0
+    MASK_ROUND: bool = False
+    MASK_DECIMALS: int = 1
+
+    # Image derivatives
+    DERIVATIVES_ON_UPLOAD: bool = True
+    DERIVATIVES_CONCURRENCY: int = 16
+    DERIVATIVES_JPEG_QUALITY: int = 85
+    THUMBNAIL_SIZE: int = 256
+    PREVIEW_SIZE: int = 2048
+    DZI_TILE_SIZE: int = 256
+    DZI_TILE_OVERLAP: int = 1
+
     # Auth
     SECRET_KEY: str = ""
     ALGORITHM: str = ""
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 0
+    AUTH_USER_CACHE_SIZE: int = 10000
+    AUTH_USER_CACHE_TTL: int = 30
+    AUTH_USER_CLAIMS: bool = False
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_QUEUE_SIZE: int = 64
+    PASSWORD_HASH_RETRY_AFTER: int = 1
+
+    # HTTP responses
+    RESPONSE_COMPRESSION: bool = True
+    COMPRESSION_MIN_SIZE: int = 1024
+    GZIP_LEVEL: int = 3
+    BROTLI_QUALITY: int = 3
+
+    # Metrics
+    METRICS_ENABLED: bool = True
+    TRACE_SPANS: bool = False
+    REQUEST_ID_HEADER: str = "X-Request-ID"
+    REPORT_WORKER_METRICS_PORT: int = 9103
 
     # CORS
     HOSTS: list = ["*"]
@@ -0,0 +1,104 @@
+from array import array
+from itertools import chain
+import json
+import struct
+import sys
+from .errors import CoordinateRangeError
+
+# Компактное хранение геометрии предсказаний: по одному bytea на детекцию.
+# Полигон — подряд идущие пары x, y в little-endian float32 или int16
+# (int16 — координаты округлены до пикселя), бокс — 4 × float32.
+DTYPES = {"float32": "f", "int16": "h"}
+INT16_RANGE = (-32768, 32767)
+
+BINARY_MAGIC = b"TSQP"
+BINARY_VERSION = 1
+BINARY_MEDIA_TYPE = "application/vnd.techsquad.prediction"
+
+
+def _to_bytes(values: array):
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode: str, blob: bytes):
+    values = array(typecode)
+    values.frombytes(blob)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _fits_int16(values):
+    low, high = INT16_RANGE
+    return all(low <= round(v) <= high for v in values)
+
+
+def masks_dtype_for(masks: list, dtype: str):
+    """
+    Тип хранения для масок предсказания: int16 только если все координаты
+    в него помещаются (длинные снимки бывают шире 32767 px), иначе float32.
+    """
+    if dtype == "int16" and not all(_fits_int16(chain.from_iterable(polygon)) for polygon in masks):
+        return "float32"
+    return dtype
+
+
+def encode_polygon(polygon: list, dtype: str):
+    flat = chain.from_iterable(polygon)
+    if dtype == "int16":
+        flat = [round(v) for v in flat]
+        if not _fits_int16(flat):
+            raise CoordinateRangeError(f"Mask coordinates must be within {INT16_RANGE} for int16 storage")
+    return _to_bytes(array(DTYPES[dtype], flat))
+
+
+def decode_polygon(blob: bytes, dtype: str):
+    flat = _from_bytes(DTYPES[dtype], blob).tolist()
+    return [flat[i:i + 2] for i in range(0, len(flat), 2)]
+
+
+def encode_box(box: list):
+    return _to_bytes(array("f", box))
+
+
+def decode_box(blob: bytes):
+    return _from_bytes("f", blob).tolist()
+
+
+def encode_polygons(masks: list, dtype: str):
+    return [encode_polygon(polygon, dtype) for polygon in masks]
+
+
+def decode_polygons(blobs: list, dtype: str):
+    return [decode_polygon(blob, dtype) for blob in blobs]
+
+
+def encode_boxes(boxes: list):
+    return [encode_box(box) for box in boxes]
+
+
+def decode_boxes(blobs: list):
+    return [decode_box(blob) for blob in blobs]
+
+
+def pack_prediction(masks_bin: list, boxes_bin: list, dtype: str, meta: dict):
+    """
+    Бинарный ответ для клиентов, которые читают геометрию напрямую:
+      magic "TSQP" | version u8 | dtype u8 (0 float32, 1 int16) | u16 reserved
+      | n u32 | meta_len u32 | meta (JSON, utf-8)
+      | offsets (n + 1) × u32 — начало полигона i в точках
+      | boxes n × 4 × f32 | coords total_points × 2 × dtype
+    Все числа little-endian.
+    """
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode()
+    point_size = 2 * array(DTYPES[dtype]).itemsize
+
+    offsets = array("I", [0])
+    for blob in masks_bin:
+        offsets.append(offsets[-1] + len(blob) // point_size)
+
+    header = struct.pack("<4sBBHII", BINARY_MAGIC, BINARY_VERSION, list(DTYPES).index(dtype), 0,
+                         len(masks_bin), len(meta_bytes))
+    return b"".join([header, meta_bytes, _to_bytes(offsets), *boxes_bin, *masks_bin])
@@ -1,10 +1,14 @@
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 import math
 import uuid
-from sqlalchemy import and_, delete, func, select, update
-from .schemas import UserBase
-from .models import File, Modelpredict, User
+from sqlalchemy import ARRAY, UUID, BigInteger, and_, any_, bindparam, delete, func, insert, literal_column, null, or_, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from .schemas import UserBase, info_prediction_patch
+from .models import File, Modelpredict, ReportJob, User
 from .database import db_dependency
+from .codecs import encode_box, encode_boxes, encode_polygon, encode_polygons, masks_dtype_for
+from .errors import CoordinateRangeError, DetectionNotFoundError, StalePredictionError
 from configs.config import settings
 
 # def cleanup_old_predictions(model, user_id_kwarg="id", db_kwarg="db", max_count=1000, delete_count=500):
@@ -40,23 +44,50 @@ async def find_file_by_id(id: uuid, db: db_dependency):
     stmt = select(File).where(File.id == id)
     
     db_file = await db.execute(statement=stmt)
-    await db.close()
     result = db_file.scalar_one_or_none()
     if result is None:
         return None
     return result.path_to_file
 
+def uuid_array(name: str, values: list):
+    # Один параметр-массив вместо IN (...): текст запроса не зависит от числа id
+    return any_(bindparam(name, list(values), type_=ARRAY(UUID)))
+
+async def find_files_by_ids(ids: list, user_id: uuid, db: db_dependency):
+    """
+    {id: path_to_file} для файлов из ids, принадлежащих user_id, одним запросом.
+    Чужие и несуществующие id в ответ не попадают.
+    """
+    stmt = select(File.id, File.path_to_file).where(and_(File.id == uuid_array("ids", ids), File.file_id == user_id))
+    db_files = await db.execute(statement=stmt)
+    return {file_id: path for file_id, path in db_files.all()}
+
 async def create_file(path_to_file: str, user: UserBase, db: db_dependency):
     db_file = File(path_to_file=path_to_file, file_id=user.id)
     db.add(db_file)
     await db.commit()
     await db.refresh(db_file)
-    await db.close()
     return db_file
 
+async def get_file_by_id(id: uuid, db: db_dependency):
+    db_file = await db.execute(select(File).where(File.id == id))
+    return db_file.scalar_one_or_none()
+
+async def change_file_derivatives(id: uuid, derivatives: dict, db: db_dependency):
+    stmt = update(File).where(File.id == id).values(**derivatives)
+    result = await db.execute(stmt)
+    await db.commit()
+    return result
+
+async def create_files(paths_to_files: list, user: UserBase, db: db_dependency):
+    """Один INSERT на все файлы запроса; возвращает id в порядке paths_to_files."""
+    rows = [{"id": uuid.uuid4(), "path_to_file": path, "file_id": user.id} for path in paths_to_files]
+    await db.execute(insert(File), rows)
+    await db.commit()
+    return [row["id"] for row in rows]
+
 async def get_user_by_email(email: str, db: db_dependency):
     db_user = await db.execute(select(User).where(User.email == email))
-    await db.close()
     result = db_user.scalar_one_or_none()
     return result
 
@@ -64,7 +95,6 @@ async def get_user_by_id(id: uuid, db: db_dependency):
     stmt = select(User).where(User.id == id)
     
     db_user = await db.execute(statement=stmt)
-    await db.close()
     result = db_user.scalar_one_or_none()
     return result
 
@@ -73,7 +103,6 @@ async def create_user(email: str, hashed_password: str, active: bool, db: db_dep
     db.add(db_user)
     await db.commit()
     await db.refresh(db_user)
-    await db.close()
     return db_user
 
 # def cleanup_old_predictions(model, user_id_kwarg="id", db_kwarg="db", max_count=1000, delete_count=500):
@@ -105,29 +134,47 @@ async def create_user(email: str, hashed_password: str, active: bool, db: db_dep
 #         return wrapper
 #     return decorator
 
+def new_detection_ids(count: int):
+    return literal_column(f"ARRAY(SELECT nextval('model_predicts_detection_id_seq') FROM generate_series(1, {int(count)}))",
+                          type_=ARRAY(BigInteger))
+
 #@cleanup_old_predictions(model=Modelpredict, user_id_kwarg="user_id", db_kwarg="db")
-async def add_prediction_to_file(file_id: uuid, 
-                                 user_id: uuid, 
-                                 masks: list, 
-                                 boxes: list,
-                                 num_classes: list,
-                                 classes: list, 
-                                 confs: list,
-                                 path_to_report: str,
-                                 db: db_dependency):
-    db_prediction = Modelpredict(file_id=file_id, 
-                                user_id=user_id, 
-                                masks=masks, 
-                                boxes=boxes,
-                                num_classes=num_classes,
-                                classes=classes, 
-                                confs=confs,
-                                path_to_report=path_to_report)
-    db.add(db_prediction)
+async def add_predictions_to_files(user_id: uuid, predictions: dict, db: db_dependency):
+    """
+    Сохраняет предсказания {file_id: pred} одним INSERT ... ON CONFLICT по
+    (user_id, file_id): повторное предсказание файла заменяет прежнее, отчёт
+    сбрасывается. created_at обновляется, чтобы запись поднялась в истории,
+    как раньше при вставке новой строки.
+    """
+    if not predictions:
+        return
+    now = datetime.utcnow()
+    rows = []
+    for file_id, pred in predictions.items():
+        masks_dtype = masks_dtype_for(pred["masks"], settings.MASKS_STORAGE_DTYPE)
+        rows.append({"id": uuid.uuid4(),
+                     "user_id": user_id,
+                     "file_id": file_id,
+                     "masks_bin": encode_polygons(pred["masks"], masks_dtype),
+                     "masks_dtype": masks_dtype,
+                     "boxes_bin": encode_boxes(pred["boxes"]),
+                     "num_classes": pred["num_classes"],
+                     "classes": pred["classes"],
+                     "confs": pred["confs"],
+                     "detection_ids": new_detection_ids(len(pred["num_classes"])),
+                     "path_to_report": None,
+                     "created_at": now,
+                     "updated_at": now})
+    stmt = pg_insert(Modelpredict).values(rows)
+    replaced = ("masks_bin", "masks_dtype", "boxes_bin", "num_classes", "classes", "confs",
+                "detection_ids", "path_to_report", "created_at", "updated_at")
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Modelpredict.user_id, Modelpredict.file_id],
+        set_={**{column: stmt.excluded[column] for column in replaced},
+              Modelpredict.masks_json: null(), Modelpredict.boxes_json: null()},
+    )
+    await db.execute(stmt)
     await db.commit()
-    await db.refresh(db_prediction)
-    await db.close()
-    return db_prediction
 
 async def change_prediction(file_id: uuid, 
                             user_id: uuid, 
@@ -136,10 +183,15 @@ async def change_prediction(file_id: uuid,
                             num_classes: list,
                             classes: list, 
                             db: db_dependency):
-    stmt = update(Modelpredict).where(and_(Modelpredict.user_id == user_id, Modelpredict.file_id == file_id)).values(masks=masks, 
-                                                                                                                boxes=boxes, 
+    masks_dtype = masks_dtype_for(masks, settings.MASKS_STORAGE_DTYPE)
+    stmt = update(Modelpredict).where(and_(Modelpredict.user_id == user_id, Modelpredict.file_id == file_id)).values(masks_bin=encode_polygons(masks, masks_dtype),
+                                                                                                                masks_dtype=masks_dtype,
+                                                                                                                masks_json=None,
+                                                                                                                boxes_bin=encode_boxes(boxes),
+                                                                                                                boxes_json=None,
                                                                                                                 num_classes=num_classes,
-                                                                                                                classes=classes)
+                                                                                                                classes=classes,
+                                                                                                                detection_ids=new_detection_ids(len(num_classes)))
     result = await db.execute(stmt)
     await db.commit()
     
@@ -148,26 +200,277 @@ async def change_prediction(file_id: uuid,
         
     return result.rowcount
 
+# Параллельные массивы детекций в model_predicts и тип их элемента
+DETECTION_COLUMNS = {
+    "masks_bin": "BYTEA",
+    "boxes_bin": "BYTEA",
+    "num_classes": "INTEGER",
+    "classes": "VARCHAR",
+    "confs": "FLOAT",
+}
+
+def _detection_values(detection, masks_dtype: str):
+    values = {}
+    if detection.mask is not None:
+        values["masks_bin"] = encode_polygon(detection.mask, masks_dtype)
+    if detection.box is not None:
+        values["boxes_bin"] = encode_box(detection.box)
+    if detection.num_class is not None:
+        values["num_classes"] = detection.num_class
+    if detection.class_name is not None:
+        values["classes"] = detection.class_name
+    if detection.conf is not None:
+        values["confs"] = detection.conf
+    return values
+
+def _patched_array(column: str, element_type: str, modified: list, removed: list, added: list, params: dict):
+    """
+    SQL-выражение нового значения колонки-массива: замена элементов по позиции
+    (CASE по ordinality), удаление позиций и дописывание новых элементов в конец.
+    Позиции 1-based, как в Postgres.
+    """
+    expr = f"model_predicts.{column}"
+    if modified or removed:
+        cases = []
+        for n, (position, value) in enumerate(modified):
+            params[f"{column}_p{n}"] = position
+            params[f"{column}_v{n}"] = value
+            cases.append(f"WHEN :{column}_p{n} THEN CAST(:{column}_v{n} AS {element_type})")
+        element = f"CASE t.i {' '.join(cases)} ELSE t.x END" if cases else "t.x"
+        where = "WHERE t.i <> ALL(CAST(:removed AS INTEGER[]))" if removed else ""
+        expr = f"ARRAY(SELECT {element} FROM unnest({expr}) WITH ORDINALITY AS t(x, i) {where} ORDER BY t.i)"
+    if added:
+        params[f"{column}_add"] = added
+        expr = f"{expr} || CAST(:{column}_add AS {element_type}[])"
+    return expr
+
+async def _ensure_binary_prediction(prediction_id: uuid, db: db_dependency):
+    # Записи в старом JSONB-формате переводятся в бинарный один раз, при первой правке
+    row = (await db.execute(select(Modelpredict.masks_json, Modelpredict.boxes_json)
+                            .where(Modelpredict.id == prediction_id))).one()
+    masks_dtype = masks_dtype_for(row.masks_json or [], settings.MASKS_STORAGE_DTYPE)
+    await db.execute(update(Modelpredict).where(Modelpredict.id == prediction_id).values(
+        masks_bin=encode_polygons(row.masks_json or [], masks_dtype),
+        boxes_bin=encode_boxes(row.boxes_json or []),
+        masks_dtype=masks_dtype,
+        masks_json=None,
+        boxes_json=None,
+        updated_at=Modelpredict.updated_at,
+    ))
+    return masks_dtype
+
+async def patch_prediction(user_id: uuid, patch: info_prediction_patch, db: db_dependency):
+    """
+    Точечная правка детекций одним UPDATE: меняются только затронутые
+    элементы массивов, по сети идут только изменённые детекции.
+    Ссылки index/id относятся к состоянию до правки; порядок применения —
+    modify, remove, add. Правка проходит, только если updated_at записи
+    совпадает с patch.updated_at, иначе StalePredictionError.
+    Возвращает (новый updated_at, id добавленных детекций) или None, если
+    записи нет.
+    """
+    expected = patch.updated_at
+    if expected.tzinfo is not None:
+        expected = expected.astimezone(timezone.utc).replace(tzinfo=None)
+
+    state = (await db.execute(
+        select(Modelpredict.id, Modelpredict.updated_at, Modelpredict.masks_dtype, Modelpredict.detection_ids,
+               Modelpredict.masks_bin.is_(None).label("legacy"), func.cardinality(Modelpredict.num_classes).label("count"))
+        .where(and_(Modelpredict.user_id == user_id, Modelpredict.file_id == patch.file_id))
+        .with_for_update()
+    )).one_or_none()
+    if state is None:
+        await db.rollback()
+        return None
+    if state.updated_at != expected:
+        await db.rollback()
+        raise StalePredictionError(state.updated_at)
+
+    positions = {detection_id: i + 1 for i, detection_id in enumerate(state.detection_ids or [])}
+    def position(detection):
+        if detection.id is not None:
+            if detection.id not in positions:
+                raise DetectionNotFoundError(f"Detection id {detection.id} not found")
+            return positions[detection.id]
+        if detection.index is None or not 0 <= detection.index < state.count:
+            raise DetectionNotFoundError(f"Detection index {detection.index} out of range")
+        return detection.index + 1
+
+    try:
+        removed = sorted({position(detection) for detection in patch.remove})
+        modified = [(position(detection), detection) for detection in patch.modify]
+    except DetectionNotFoundError:
+        await db.rollback()
+        raise
+
+    masks_dtype = state.masks_dtype
+    if state.legacy:
+        masks_dtype = await _ensure_binary_prediction(state.id, db)
+
+    params = {"id": state.id, "now": datetime.utcnow()}
+    if removed:
+        params["removed"] = removed
+    assignments = []
+    try:
+        for column, element_type in DETECTION_COLUMNS.items():
+            column_modified = []
+            for pos, detection in modified:
+                values = _detection_values(detection, masks_dtype)
+                if column in values:
+                    column_modified.append((pos, values[column]))
+            column_added = [_detection_values(detection, masks_dtype)[column] for detection in patch.add]
+            if column_modified or removed or column_added:
+                assignments.append(f"{column} = {_patched_array(column, element_type, column_modified, removed, column_added, params)}")
+    except CoordinateRangeError:
+        await db.rollback()
+        raise
+
+    kept = state.count - len(removed)
+    params["first_added"] = kept + 1
+    if state.detection_ids is None:
+        params["n_total"] = kept + len(patch.add)
+        detection_ids = "ARRAY(SELECT nextval('model_predicts_detection_id_seq') FROM generate_series(1, CAST(:n_total AS INTEGER)))"
+    else:
+        params["n_add"] = len(patch.add)
+        detection_ids = (f"{_patched_array('detection_ids', 'BIGINT', [], removed, [], params)} || "
+                         "ARRAY(SELECT nextval('model_predicts_detection_id_seq') FROM generate_series(1, CAST(:n_add AS INTEGER)))")
+    assignments.append(f"detection_ids = {detection_ids}")
+    assignments.append("updated_at = :now")
+
+    stmt = text(f"UPDATE model_predicts SET {', '.join(assignments)} WHERE id = :id "
+                "RETURNING updated_at, detection_ids[CAST(:first_added AS INTEGER):]")
+    row = (await db.execute(stmt, params)).one()
+    await db.commit()
+    return row[0], list(row[1] or [])
+
 async def change_active(user_id: uuid, active: bool, db: db_dependency):
     stmt = update(User).where(User.id == user_id).values(is_active=active)
     result = await db.execute(stmt)
     await db.commit()
-    await db.close()
     return result
 
-async def get_history_by_user_id_per_page(id: uuid, page: int, db: db_dependency):
-    main_stmt = select(Modelpredict).where(Modelpredict.user_id == id).order_by(Modelpredict.created_at.desc())
-    db_history = await db.execute(statement=main_stmt)
-    db_history = db_history.scalars().fetchall()
-    await db.close()
+async def change_password_hash(user_id: uuid, hashed_password: str, db: db_dependency):
+    stmt = update(User).where(User.id == user_id).values(hashed_password=hashed_password)
+    result = await db.execute(stmt)
+    await db.commit()
+    return result
+
+async def get_history_by_user_id_per_page(id: uuid, page: int, db: db_dependency, cursor: tuple = None):
+    """
+    Страница истории без тяжёлых колонок masks/boxes. Без cursor — LIMIT/OFFSET
+    по номеру страницы и общее число страниц; с cursor (created_at, id последней
+    записи предыдущей страницы) — keyset-пагинация, total не считается.
+    Возвращает строки страницы, total и признак наличия следующей страницы.
+    """
+    limit = settings.LIMIT_ITEMS_PER_PAGE
+    main_stmt = (select(Modelpredict.id, Modelpredict.user_id, Modelpredict.file_id, Modelpredict.created_at, Modelpredict.updated_at)
+                 .where(Modelpredict.user_id == id)
+                 .order_by(Modelpredict.created_at.desc(), Modelpredict.id.desc())
+                 .limit(limit + 1))
+    if cursor is not None:
+        main_stmt = main_stmt.where(tuple_(Modelpredict.created_at, Modelpredict.id) < tuple_(*cursor))
+    else:
+        main_stmt = main_stmt.offset(page * limit)
+
+    db_history = (await db.execute(statement=main_stmt)).all()
+    has_next = len(db_history) > limit
+    db_history = db_history[:limit]
 
-    total = math.ceil(len(db_history) / settings.LIMIT_ITEMS_PER_PAGE) - 1
-    result = db_history[page*settings.LIMIT_ITEMS_PER_PAGE:(page+1)*settings.LIMIT_ITEMS_PER_PAGE]
-    return result, total
+    total = None
+    if cursor is None:
+        count_stmt = select(func.count()).select_from(Modelpredict).where(Modelpredict.user_id == id)
+        total = math.ceil((await db.execute(count_stmt)).scalar_one() / limit) - 1
+    return db_history, total, has_next
 
 async def get_history_by_user_file_id(user_id: uuid, file_id: uuid, db: db_dependency):
     stmt = select(Modelpredict).filter(and_(Modelpredict.user_id == user_id, Modelpredict.file_id == file_id))
     db_history = await db.execute(statement=stmt)
-    await db.close()
     result = db_history.scalar_one_or_none()
     return result
+
+async def enqueue_reports(user_id: uuid, files_id: list, db: db_dependency, request_id: str = None):
+    """
+    Ставит (или перезапускает) генерацию отчётов для предсказаний файлов.
+    request_id запроса сохраняется в задачах, чтобы воркер продолжил его трассировку.
+    """
+    if not files_id:
+        return
+    now = datetime.utcnow()
+    stmt = pg_insert(ReportJob).values([{"id": uuid.uuid4(), "user_id": user_id, "file_id": file_id, "status": "pending",
+                                         "attempts": 0, "run_after": now, "request_id": request_id,
+                                         "created_at": now, "updated_at": now}
+                                        for file_id in files_id])
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_report_jobs_user_id_file_id",
+        set_={"status": "pending", "attempts": 0, "last_error": None, "run_after": now, "locked_at": None,
+              "claim_token": None, "request_id": request_id, "updated_at": now},
+    )
+    await db.execute(stmt)
+    await db.execute(update(Modelpredict)
+                     .where(and_(Modelpredict.user_id == user_id, Modelpredict.file_id == uuid_array("files_id", files_id)))
+                     .values(path_to_report=None, updated_at=Modelpredict.updated_at))
+    await db.commit()
+
+async def enqueue_report(user_id: uuid, file_id: uuid, db: db_dependency, request_id: str = None):
+    await enqueue_reports(user_id=user_id, files_id=[file_id], db=db, request_id=request_id)
+
+async def get_report_path(user_id: uuid, file_id: uuid, db: db_dependency):
+    """(id, path_to_report) предсказания без тяжёлых колонок или None."""
+    result = await db.execute(select(Modelpredict.id, Modelpredict.path_to_report)
+                              .where(and_(Modelpredict.user_id == user_id, Modelpredict.file_id == file_id)))
+    return result.first()
+
+async def get_report_job(user_id: uuid, file_id: uuid, db: db_dependency):
+    result = await db.execute(select(ReportJob).where(and_(ReportJob.user_id == user_id, ReportJob.file_id == file_id)))
+    return result.scalar_one_or_none()
+
+async def claim_report_jobs(limit: int, db: db_dependency):
+    """
+    Забирает до limit готовых к запуску задач. FOR UPDATE SKIP LOCKED позволяет
+    нескольким воркерам разбирать очередь без блокировок друг друга; задачи,
+    зависшие в running дольше REPORT_LOCK_TIMEOUT (упавший воркер), забираются снова.
+    Каждый захват получает свой claim_token: по нему complete/fail отличают
+    свой захват от более позднего, даже если attempts после перезапуска совпали.
+    """
+    now = datetime.utcnow()
+    claim_token = uuid.uuid4()
+    ready = (select(ReportJob.id)
+             .where(or_(and_(ReportJob.status == "pending", ReportJob.run_after <= now),
+                        and_(ReportJob.status == "running",
+                             ReportJob.locked_at < now - timedelta(seconds=settings.REPORT_LOCK_TIMEOUT))))
+             .order_by(ReportJob.run_after)
+             .limit(limit)
+             .with_for_update(skip_locked=True))
+    stmt = (update(ReportJob)
+            .where(ReportJob.id.in_(ready.scalar_subquery()))
+            .values(status="running", attempts=ReportJob.attempts + 1, locked_at=now, claim_token=claim_token, updated_at=now)
+            .returning(ReportJob.id, ReportJob.user_id, ReportJob.file_id, ReportJob.attempts, ReportJob.request_id,
+                       ReportJob.claim_token))
+    jobs = (await db.execute(stmt)).all()
+    await db.commit()
+    return jobs
+
+async def complete_report_job(job_id: uuid, claim_token: uuid, user_id: uuid, file_id: uuid, path_to_report: str, db: db_dependency):
+    # Если задачу успели перезапустить (новое предсказание), результат устарел
+    claimed = and_(ReportJob.id == job_id, ReportJob.status == "running", ReportJob.claim_token == claim_token)
+    result = await db.execute(update(ReportJob).where(claimed).values(status="done", last_error=None, locked_at=None,
+                                                                      claim_token=None))
+    if result.rowcount == 0:
+        await db.rollback()
+        return False
+    await db.execute(update(Modelpredict)
+                     .where(and_(Modelpredict.user_id == user_id, Modelpredict.file_id == file_id))
+                     .values(path_to_report=path_to_report, updated_at=Modelpredict.updated_at))
+    await db.commit()
+    return True
+
+async def fail_report_job(job_id: uuid, claim_token: uuid, attempts: int, error: str, db: db_dependency):
+    values = {"last_error": error, "locked_at": None, "claim_token": None}
+    if attempts >= settings.REPORT_MAX_ATTEMPTS:
+        values["status"] = "failed"
+    else:
+        values["status"] = "pending"
+        values["run_after"] = datetime.utcnow() + timedelta(seconds=settings.REPORT_RETRY_DELAY * attempts)
+    claimed = and_(ReportJob.id == job_id, ReportJob.status == "running", ReportJob.claim_token == claim_token)
+    await db.execute(update(ReportJob).where(claimed).values(**values))
+    await db.commit()
@@ -1,31 +1,84 @@
+import asyncio
+from contextlib import AsyncExitStack
 from typing import Annotated
 from fastapi import Depends
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
+from common.metrics import instrument_engine, instrument_s3
 from configs.config import settings
 from aiobotocore.session import get_session
 from aiobotocore.client import BaseClient
+from aiobotocore.config import AioConfig
 
 DATABASE_URL = f'postgresql+asyncpg://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}@{settings.POSTGRES_HOST}:{settings.POSTGRES_PORT}/{settings.POSTGRES_DB}'
-engine = create_async_engine(DATABASE_URL)#, echo=True)
+# Один движок на процесс. pre_ping отсеивает соединения, закрытые Postgres
+# или балансировщиком; asyncpg переиспользует подготовленные выражения
+# (statement_cache_size — кэш asyncpg, prepared_statement_cache_size — кэш
+# диалекта SQLAlchemy). За pgbouncer в режиме transaction оба кэша нужно обнулить.
+engine = create_async_engine(DATABASE_URL,
+                             pool_size=settings.DB_POOL_SIZE,
+                             max_overflow=settings.DB_MAX_OVERFLOW,
+                             pool_timeout=settings.DB_POOL_TIMEOUT,
+                             pool_recycle=settings.DB_POOL_RECYCLE,
+                             pool_pre_ping=settings.DB_POOL_PRE_PING,
+                             connect_args={"statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+                                           "prepared_statement_cache_size": settings.DB_PREPARED_STATEMENT_CACHE_SIZE})#, echo=True)
+instrument_engine(engine)
 async_session_maker = async_sessionmaker(bind=engine, expire_on_commit=False)
 Base = declarative_base()
 
 async def get_db():
-    db = async_session_maker()
-    try:
+    """
+    Сессия на время запроса. CRUD-функции её не закрывают; фоновые задачи
+    открывают свою через async_session_maker, а не получают эту.
+    """
+    async with async_session_maker() as db:
         yield db
-    finally:
-        await db.close()
+
+async def release_connection(db: AsyncSession):
+    """
+    Завершает транзакцию чтения и возвращает соединение в пул перед долгой
+    работой без БД (bcrypt, S3, инференс). Сессия остаётся рабочей, загруженные
+    объекты не отсоединяются; следующий запрос к БД возьмёт соединение снова.
+    """
+    await db.commit()
 
 db_dependency = Annotated[AsyncSession, Depends(get_db)]
 
+S3_CLIENT = None
+_s3_stack = None
+_s3_lock = asyncio.Lock()
+
+def open_s3_client():
+    config = AioConfig(max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                       connector_args={"keepalive_timeout": settings.S3_KEEPALIVE_TIMEOUT})
+    return get_session().create_client(service_name=settings.S3_SERVICE_NAME, 
+                                       region_name=settings.S3_REGION,
+                                       endpoint_url=settings.S3_ENDPOINT_URL,
+                                       aws_access_key_id=settings.S3_ACCESS_KEY_ID,
+                                       aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY,
+                                       config=config)
+
+async def start_s3_client():
+    """Создаёт общий на всё время жизни приложения S3-клиент с пулом соединений."""
+    global S3_CLIENT, _s3_stack
+    async with _s3_lock:
+        if S3_CLIENT is None:
+            _s3_stack = AsyncExitStack()
+            S3_CLIENT = await _s3_stack.enter_async_context(open_s3_client())
+            instrument_s3(S3_CLIENT)
+    return S3_CLIENT
+
+async def stop_s3_client():
+    global S3_CLIENT, _s3_stack
+    async with _s3_lock:
+        if _s3_stack is not None:
+            await _s3_stack.aclose()
+        S3_CLIENT, _s3_stack = None, None
+
 async def get_s3_client():
-    async with get_session().create_client(service_name=settings.S3_SERVICE_NAME, 
-                                           region_name=settings.S3_REGION,
-                                           endpoint_url=settings.S3_ENDPOINT_URL,
-                                           aws_access_key_id=settings.S3_ACCESS_KEY_ID,
-                                           aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY) as s3:
-        yield s3
-
-s3_dependency = Annotated[BaseClient, Depends(get_s3_client)]
\ No newline at end of file
+    if S3_CLIENT is None:
+        return await start_s3_client()
+    return S3_CLIENT
+
+s3_dependency = Annotated[BaseClient, Depends(get_s3_client)]
@@ -0,0 +1,12 @@
+class StalePredictionError(Exception):
+    """Предсказание изменено после того, как клиент его прочитал."""
+    def __init__(self, updated_at):
+        super().__init__(updated_at)
+        self.updated_at = updated_at
+
+class DetectionNotFoundError(Exception):
+    pass
+
+class CoordinateRangeError(ValueError):
+    """Координата полигона не помещается в тип хранения масок (int16)."""
+    pass
@@ -0,0 +1,84 @@
+import asyncio
+from sqlalchemy import select, text, update
+from .codecs import encode_boxes, encode_polygons, masks_dtype_for
+from .database import async_session_maker, engine
+from .models import Modelpredict
+from configs.config import settings
+
+# Идемпотентные DDL поверх Base.metadata.create_all для уже существующих таблиц.
+MIGRATIONS = [
+    "ALTER TABLE model_predicts ADD COLUMN IF NOT EXISTS masks_bin BYTEA[]",
+    "ALTER TABLE model_predicts ADD COLUMN IF NOT EXISTS boxes_bin BYTEA[]",
+    "ALTER TABLE model_predicts ADD COLUMN IF NOT EXISTS masks_dtype VARCHAR",
+    "ALTER TABLE model_predicts ALTER COLUMN masks DROP NOT NULL",
+    "ALTER TABLE model_predicts ALTER COLUMN boxes DROP NOT NULL",
+    "ALTER TABLE files ADD COLUMN IF NOT EXISTS width INTEGER",
+    "ALTER TABLE files ADD COLUMN IF NOT EXISTS height INTEGER",
+    "ALTER TABLE files ADD COLUMN IF NOT EXISTS thumbnail_url VARCHAR",
+    "ALTER TABLE files ADD COLUMN IF NOT EXISTS preview_url VARCHAR",
+    "ALTER TABLE files ADD COLUMN IF NOT EXISTS dzi_url VARCHAR",
+    "CREATE INDEX IF NOT EXISTS ix_model_predicts_user_id_created_at ON model_predicts (user_id, created_at DESC, id DESC)",
+    "CREATE SEQUENCE IF NOT EXISTS model_predicts_detection_id_seq",
+    "ALTER TABLE model_predicts ADD COLUMN IF NOT EXISTS detection_ids BIGINT[]",
+    "ALTER TABLE model_predicts ALTER COLUMN path_to_report DROP NOT NULL",
+    "ALTER TABLE report_jobs ADD COLUMN IF NOT EXISTS request_id VARCHAR",
+    "ALTER TABLE report_jobs ADD COLUMN IF NOT EXISTS claim_token UUID",
+    # Раньше каждое предсказание вставлялось новой строкой. Перед созданием
+    # уникального индекса оставляем только последнее по файлу — один раз:
+    # когда индекс уже есть, дублей быть не может и DELETE не выполняется.
+    "DO $$ BEGIN "
+    "IF to_regclass('uq_model_predicts_user_id_file_id') IS NULL THEN "
+    "DELETE FROM model_predicts p USING model_predicts newer "
+    "WHERE p.user_id = newer.user_id AND p.file_id = newer.file_id "
+    "AND (p.created_at, p.id) < (newer.created_at, newer.id); "
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_model_predicts_user_id_file_id ON model_predicts (user_id, file_id); "
+    "END IF; END $$",
+]
+
+async def run_migrations(conn):
+    for statement in MIGRATIONS:
+        await conn.execute(text(statement))
+
+async def backfill_binary_predictions(batch_size: int = 100):
+    """Переводит записи со старым JSONB-форматом масок и боксов в masks_bin/boxes_bin."""
+    converted = 0
+    while True:
+        async with async_session_maker() as db:
+            stmt = (select(Modelpredict.id, Modelpredict.masks_json, Modelpredict.boxes_json)
+                    .where(Modelpredict.masks_bin.is_(None))
+                    .limit(batch_size))
+            rows = (await db.execute(stmt)).all()
+            if not rows:
+                return converted
+            for row_id, masks, boxes in rows:
+                masks_dtype = masks_dtype_for(masks or [], settings.MASKS_STORAGE_DTYPE)
+                await db.execute(update(Modelpredict).where(Modelpredict.id == row_id).values(
+                    masks_bin=encode_polygons(masks or [], masks_dtype),
+                    boxes_bin=encode_boxes(boxes or []),
+                    masks_dtype=masks_dtype,
+                    masks_json=None,
+                    boxes_json=None,
+                ))
+            await db.commit()
+        converted += len(rows)
+        print(f"Converted {converted} predictions")
+
+async def backfill_detection_ids():
+    """Выдаёт стабильные id детекциям в записях, созданных до появления detection_ids."""
+    async with engine.begin() as conn:
+        result = await conn.execute(text(
+            "UPDATE model_predicts SET detection_ids = "
+            "ARRAY(SELECT nextval('model_predicts_detection_id_seq') FROM generate_series(1, cardinality(num_classes))) "
+            "WHERE detection_ids IS NULL"
+        ))
+    print(f"Assigned detection ids to {result.rowcount} predictions")
+
+async def main():
+    async with engine.begin() as conn:
+        await run_migrations(conn)
+    await backfill_binary_predictions()
+    await backfill_detection_ids()
+    await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
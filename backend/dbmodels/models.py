@@ -1,15 +1,22 @@
 from datetime import datetime
 import uuid
-from sqlalchemy import UUID, Boolean, Column, Float, Integer, String, ForeignKey, TIMESTAMP, ARRAY
+from sqlalchemy import UUID, BigInteger, Boolean, Column, Float, Index, Integer, LargeBinary, Sequence, String, ForeignKey, TIMESTAMP, ARRAY, UniqueConstraint
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from .database import Base
+from .codecs import decode_boxes, decode_polygons, encode_boxes, encode_polygons, masks_dtype_for
+from configs.config import settings
 
 class File(Base):
     __tablename__ = 'files'
 
     id = Column(UUID, primary_key=True, default=uuid.uuid4)
     path_to_file = Column(String, nullable=False)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    thumbnail_url = Column(String, nullable=True)
+    preview_url = Column(String, nullable=True)
+    dzi_url = Column(String, nullable=True)
     created_at = Column(TIMESTAMP, default=datetime.utcnow)
     updated_at = Column(TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -28,18 +35,75 @@ class User(Base):
     
     user_path_file = relationship("File", back_populates="users")
 
+# Общая последовательность для стабильных id детекций во всех предсказаниях
+detection_id_seq = Sequence("model_predicts_detection_id_seq", metadata=Base.metadata)
+
 class Modelpredict(Base):
     __tablename__ = 'model_predicts'
 
     id = Column(UUID, primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID, ForeignKey("users.id"), nullable=False)
     file_id = Column(UUID, ForeignKey("files.id"), nullable=False)
-    masks = Column(JSONB, nullable=False)
-    boxes = Column(JSONB, nullable=False)
+    # Старый формат (JSONB), заполнен только у записей до миграции в masks_bin/boxes_bin
+    masks_json = Column("masks", JSONB, nullable=True)
+    boxes_json = Column("boxes", JSONB, nullable=True)
+    masks_bin = Column(ARRAY(LargeBinary), nullable=True)
+    boxes_bin = Column(ARRAY(LargeBinary), nullable=True)
+    masks_dtype = Column(String, nullable=True)
     num_classes = Column(ARRAY(Integer), nullable=False)
     classes = Column(ARRAY(String), nullable=False)
     confs = Column(ARRAY(Float), nullable=False)
-    path_to_report = Column(String, nullable=False)
+    # id детекций, параллельно num_classes; не меняются при удалении соседних детекций
+    detection_ids = Column(ARRAY(BigInteger), nullable=True)
+    # Заполняется воркером отчётов (modelService.report_worker) после генерации PDF
+    path_to_report = Column(String, nullable=True)
     created_at = Column(TIMESTAMP, default=datetime.utcnow)
     updated_at = Column(TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow)
-    
+
+    @property
+    def masks(self):
+        if self.masks_bin is not None:
+            return decode_polygons(self.masks_bin, self.masks_dtype)
+        return self.masks_json
+
+    @masks.setter
+    def masks(self, value):
+        self.masks_dtype = masks_dtype_for(value, settings.MASKS_STORAGE_DTYPE)
+        self.masks_bin = encode_polygons(value, self.masks_dtype)
+        self.masks_json = None
+
+    @property
+    def boxes(self):
+        if self.boxes_bin is not None:
+            return decode_boxes(self.boxes_bin)
+        return self.boxes_json
+
+    @boxes.setter
+    def boxes(self, value):
+        self.boxes_bin = encode_boxes(value)
+        self.boxes_json = None
+
+Index("ix_model_predicts_user_id_created_at", Modelpredict.user_id, Modelpredict.created_at.desc(), Modelpredict.id.desc())
+# Одно предсказание на файл пользователя; по нему работает upsert в add_predictions_to_files
+Index("uq_model_predicts_user_id_file_id", Modelpredict.user_id, Modelpredict.file_id, unique=True)
+
+class ReportJob(Base):
+    """Очередь генерации PDF-отчётов; воркеры забирают задачи через FOR UPDATE SKIP LOCKED."""
+    __tablename__ = 'report_jobs'
+    __table_args__ = (UniqueConstraint("user_id", "file_id", name="uq_report_jobs_user_id_file_id"),)
+
+    id = Column(UUID, primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID, ForeignKey("users.id"), nullable=False)
+    file_id = Column(UUID, ForeignKey("files.id"), nullable=False)
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
+    run_after = Column(TIMESTAMP, default=datetime.utcnow)
+    locked_at = Column(TIMESTAMP, nullable=True)
+    # Выдаётся при каждом захвате задачи воркером; сбрасывается при перезапуске
+    claim_token = Column(UUID, nullable=True)
+    request_id = Column(String, nullable=True)
+    created_at = Column(TIMESTAMP, default=datetime.utcnow)
+    updated_at = Column(TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+Index("ix_report_jobs_status_run_after", ReportJob.status, ReportJob.run_after)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, ConfigDict, EmailStr
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 from uuid import UUID
 
@@ -15,6 +15,23 @@ class info_prediction(BaseModel):
 
     model_config = ConfigDict(from_attributes=True)
 
+class detection_patch(BaseModel):
+    # Ссылка на детекцию: index — позиция до применения правки, id — стабильный id из detection_ids
+    index: Optional[int] = None
+    id: Optional[int] = None
+    mask: Optional[List[List[float]]] = None
+    box: Optional[List[float]] = None
+    num_class: Optional[int] = None
+    class_name: Optional[str] = None
+    conf: Optional[float] = None
+
+class info_prediction_patch(BaseModel):
+    file_id: UUID
+    updated_at: datetime
+    add: List[detection_patch] = []
+    modify: List[detection_patch] = []
+    remove: List[detection_patch] = []
+
 class UserBase(BaseModel):
     id: UUID
     email: str
@@ -43,7 +60,7 @@ class HistorFullResponseDB(BaseModel):
     num_classes: List[int]
     classes: List[str]
     confs: List[float]
-    path_to_report: str
+    path_to_report: Optional[str]
     created_at: datetime
     updated_at: datetime
     model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
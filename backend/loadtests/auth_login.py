@@ -0,0 +1,60 @@
+"""
+Нагрузочный тест логина: N пользователей одновременно логинятся в authService,
+в конце печатаются p50/p95/p99 латентности и число ответов 503.
+
+    python -m loadtests.auth_login --url http://localhost:8001 --users 50 --rounds 10
+
+Перед замером скрипт регистрирует пользователей loadtest-<i>@example.com
+(повторная регистрация просто возвращает 400 и игнорируется).
+"""
+import argparse
+import asyncio
+from collections import Counter
+import statistics
+import time
+import aiohttp
+from .stats import percentile
+
+
+async def signup_users(session: aiohttp.ClientSession, url: str, users: int, password: str):
+    async def signup(i):
+        async with session.post(f"{url}/auth/signup", json={"email": f"loadtest-{i}@example.com", "password": password}) as resp:
+            await resp.read()
+    await asyncio.gather(*(signup(i) for i in range(users)))
+
+
+async def login_loop(session: aiohttp.ClientSession, url: str, i: int, rounds: int, password: str,
+                     latencies: list, statuses: Counter):
+    payload = {"email": f"loadtest-{i}@example.com", "password": password}
+    for _ in range(rounds):
+        start = time.perf_counter()
+        async with session.post(f"{url}/auth/login", json=payload) as resp:
+            await resp.read()
+            statuses[resp.status] += 1
+        latencies.append(time.perf_counter() - start)
+
+
+async def main(args):
+    latencies, statuses = [], Counter()
+    connector = aiohttp.TCPConnector(limit=args.users)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await signup_users(session, args.url, args.users, args.password)
+        start = time.perf_counter()
+        await asyncio.gather(*(login_loop(session, args.url, i, args.rounds, args.password, latencies, statuses)
+                               for i in range(args.users)))
+        elapsed = time.perf_counter() - start
+
+    ms = [v * 1000 for v in latencies]
+    print(f"users={args.users} requests={len(ms)} elapsed={elapsed:.2f}s rps={len(ms) / elapsed:.1f}")
+    print(f"p50={percentile(ms, 50):.1f}ms p95={percentile(ms, 95):.1f}ms "
+          f"p99={percentile(ms, 99):.1f}ms mean={statistics.fmean(ms):.1f}ms")
+    print("statuses:", dict(statuses))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Login load test for authService")
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--password", default="loadtest-password")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,70 @@
+"""Сбор латентностей и ошибок нагрузочных тестов по эндпоинтам и интервалам времени."""
+from collections import Counter, defaultdict
+import time
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+class Recorder:
+    """
+    Итог по каждому эндпоинту (латентности, статусы, ошибки) и срезы
+    по интервалам interval секунд: по ним видно, где рост числа
+    пользователей перестаёт давать рост пропускной способности.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.errors = Counter()
+        self._window = []
+        self._window_started = self.started
+        self.timeline = []
+
+    def record(self, endpoint: str, seconds: float, status, ok: bool):
+        self.latencies[endpoint].append(seconds)
+        self.statuses[endpoint][status] += 1
+        if not ok:
+            self.errors[endpoint] += 1
+        self._window.append((seconds, ok))
+
+    def flush(self, users: int):
+        """Закрывает текущий интервал; вызывается контроллером нагрузки раз в interval."""
+        now = time.perf_counter()
+        elapsed = now - self._window_started
+        window, self._window, self._window_started = self._window, [], now
+        ms = [seconds * 1000 for seconds, _ in window]
+        point = {
+            "t": round(now - self.started, 1),
+            "users": users,
+            "rps": round(len(window) / elapsed, 2) if elapsed > 0 else 0.0,
+            "errors": sum(1 for _, ok in window if not ok),
+            "p50_ms": round(percentile(ms, 50), 1),
+            "p95_ms": round(percentile(ms, 95), 1),
+        }
+        self.timeline.append(point)
+        return point
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        result = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            ms = [seconds * 1000 for seconds in values]
+            result[endpoint] = {
+                "requests": len(ms),
+                "rps": round(len(ms) / elapsed, 2),
+                "error_rate": round(self.errors[endpoint] / len(ms), 4),
+                "p50_ms": round(percentile(ms, 50), 1),
+                "p95_ms": round(percentile(ms, 95), 1),
+                "p99_ms": round(percentile(ms, 99), 1),
+                "max_ms": round(max(ms), 1),
+                "statuses": {str(status): count for status, count in self.statuses[endpoint].items()},
+            }
+        return result
@@ -0,0 +1,280 @@
+"""
+Нагрузочный тест пользовательских сценариев против authService, clientService
+и modelService: регистрация и логин, загрузка нескольких снимков, предсказание,
+просмотр истории и правка разметки. Число виртуальных пользователей меняется
+по профилю разгона; по ходу теста раз в --interval секунд печатаются rps, ошибки
+и p95, в конце — пропускная способность, p50/p95/p99 и доля ошибок по эндпоинтам.
+
+    python -m loadtests.user_flows --profile 30s:5,60s:5,2m:40,30s:0 --json run.json
+
+Профиль — этапы "длительность:пользователи"; на каждом этапе число пользователей
+линейно меняется от предыдущего значения до заданного. Насыщение сервиса видно
+по срезам: пользователей больше, rps не растёт, p95 растёт.
+
+Стенд с локальными Postgres и MinIO:
+
+    docker compose -f docker-compose.yml -f backend/loadtests/docker-compose.yml up --build
+
+Подойдёт и S3 в памяти (например, moto_server): пропишите его в S3_* в
+configs/.env и запустите тест с --create-buckets.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+import aiohttp
+import numpy as np
+from benchmarks.fixtures import encode_image, synthetic_radiograph
+from .stats import Recorder
+
+
+def parse_duration(value: str):
+    if value.endswith("m"):
+        return float(value[:-1]) * 60
+    return float(value.rstrip("s"))
+
+
+def parse_profile(profile: str):
+    stages = []
+    for item in profile.split(","):
+        duration, users = item.strip().split(":")
+        stages.append((parse_duration(duration), int(users)))
+    return stages
+
+
+def target_users(stages: list, elapsed: float):
+    """Число пользователей в момент elapsed или None, если профиль закончился."""
+    previous, start = 0, 0.0
+    for duration, users in stages:
+        if elapsed < start + duration:
+            return round(previous + (users - previous) * (elapsed - start) / duration)
+        previous, start = users, start + duration
+    return None
+
+
+class VirtualUser:
+    def __init__(self, index: int, session: aiohttp.ClientSession, recorder: Recorder, images: list, args):
+        self.session = session
+        self.recorder = recorder
+        self.images = images
+        self.args = args
+        self.email = f"loadtest-{args.run_id}-{index}@example.com"
+        self.files = []
+        self.stopping = False
+
+    async def request(self, endpoint: str, method: str, url: str, expected=(200,), **kwargs):
+        started = time.perf_counter()
+        try:
+            async with self.session.request(method, url, **kwargs) as resp:
+                body = await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.recorder.record(endpoint, time.perf_counter() - started, type(e).__name__, ok=False)
+            return None, None
+        self.recorder.record(endpoint, time.perf_counter() - started, resp.status, ok=resp.status in expected)
+        return resp.status, body
+
+    async def login(self):
+        payload = {"email": self.email, "password": self.args.password}
+        # 400 — пользователь уже есть (повторный запуск с тем же --run-id)
+        await self.request("auth/signup", "POST", f"{self.args.auth_url}/auth/signup", expected=(201, 400), json=payload)
+        status, body = await self.request("auth/login", "POST", f"{self.args.auth_url}/auth/login", json=payload)
+        if status != 200:
+            return False
+        # Cookie ставит authService; задаём её явно, чтобы она уходила и на другие порты/хосты
+        self.session.cookie_jar.update_cookies({"at": json.loads(body)["access_token"]})
+        return True
+
+    async def upload_and_predict(self):
+        form = aiohttp.FormData()
+        for i in range(self.args.files):
+            image = random.choice(self.images)
+            if not self.args.cached:
+                # Хвост после маркера конца JPEG декодер игнорирует, но он меняет SHA-256
+                # снимка — иначе все предсказания после первых отдавал бы кэш
+                image += uuid.uuid4().bytes
+            form.add_field("files", image, filename=f"weld-{i}.jpg", content_type="image/jpeg")
+        status, body = await self.request("file/upload", "POST", f"{self.args.client_url}/client/file/", data=form)
+        if status != 200:
+            return
+        file_ids = json.loads(body)["files"]
+
+        status, _ = await self.request("model/predict", "POST", f"{self.args.model_url}/model/predict",
+                                       json={"files_id": file_ids})
+        if status != 200:
+            return
+        self.files.extend(file_ids)
+        await self.edit(random.choice(file_ids))
+
+    async def detail(self, file_id: str):
+        # /predict сохраняет результат фоновой задачей после ответа, поэтому 404 сразу после него ожидаем
+        for _ in range(self.args.detail_retries):
+            status, body = await self.request("client/history/{file_id}", "GET",
+                                              f"{self.args.client_url}/client/history/{file_id}",
+                                              expected=(200, 404))
+            if status == 200:
+                return json.loads(body)
+            if status != 404:
+                return None
+            await asyncio.sleep(0.5)
+        return None
+
+    async def edit(self, file_id: str):
+        detail = await self.detail(file_id)
+        if not detail or not detail.get("detection_ids"):
+            return
+        patch = {
+            "file_id": file_id,
+            "updated_at": detail["version"],
+            "modify": [{"id": detail["detection_ids"][0], "conf": round(random.uniform(0.5, 1.0), 3)}],
+        }
+        await self.request("model/update_predict/detections", "PATCH",
+                           f"{self.args.model_url}/model/update_predict/detections", json=patch)
+
+    async def browse(self):
+        cursor = None
+        for _ in range(self.args.history_pages):
+            params = {"cursor": cursor} if cursor else {}
+            # 400 — у пользователя ещё нет истории
+            status, body = await self.request("client/history", "GET", f"{self.args.client_url}/client/history",
+                                              expected=(200, 400), params=params)
+            if status != 200:
+                break
+            cursor = json.loads(body)["next_cursor"]
+            if not cursor:
+                break
+        if self.files:
+            await self.detail(random.choice(self.files))
+
+    async def run(self):
+        if not await self.login():
+            return
+        while not self.stopping:
+            if not self.files or random.random() < self.args.upload_ratio:
+                await self.upload_and_predict()
+            else:
+                await self.browse()
+            if self.args.think > 0:
+                await asyncio.sleep(random.expovariate(1 / self.args.think))
+
+
+async def create_buckets():
+    """Бакеты для S3 в памяти или свежего MinIO, по настройкам из configs/.env."""
+    from botocore.exceptions import ClientError
+    from configs.config import settings
+    from dbmodels.database import open_s3_client
+
+    async with open_s3_client() as s3:
+        for bucket in (settings.S3_BUCKET_NAME_IMAGES, settings.S3_BUCKET_NAME_PDF):
+            try:
+                await s3.create_bucket(Bucket=bucket)
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in ("BucketAlreadyOwnedByYou", "BucketAlreadyExists"):
+                    raise
+
+
+def print_summary(summary: dict):
+    print(f"\n{'endpoint':<34}{'requests':>9}{'rps':>8}{'errors':>8}{'p50':>9}{'p95':>9}{'p99':>9}  statuses")
+    for endpoint, stats in summary.items():
+        print(f"{endpoint:<34}{stats['requests']:>9}{stats['rps']:>8.1f}{stats['error_rate'] * 100:>7.1f}%"
+              f"{stats['p50_ms']:>9.0f}{stats['p95_ms']:>9.0f}{stats['p99_ms']:>9.0f}  {stats['statuses']}")
+
+
+async def main(args):
+    if args.create_buckets:
+        await create_buckets()
+
+    rng = np.random.default_rng(args.seed)
+    random.seed(args.seed)
+    images = [encode_image(synthetic_radiograph(args.height, args.width, rng), "jpg") for _ in range(args.distinct_images)]
+    stages = parse_profile(args.profile)
+    recorder = Recorder(args.interval)
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+
+    async def run_user(user: VirtualUser):
+        try:
+            await user.run()
+        finally:
+            await user.session.close()
+
+    users = {}
+    index = 0
+    next_flush = args.interval
+    print(f"run_id={args.run_id} profile={args.profile}")
+    while True:
+        elapsed = time.perf_counter() - recorder.started
+        target = target_users(stages, elapsed)
+        users = {user: task for user, task in users.items() if not task.done()}
+        if target is None:
+            break
+
+        active = [user for user in users if not user.stopping]
+        for user in active[target:]:
+            # Пользователь доделывает текущий сценарий и выходит
+            user.stopping = True
+        for _ in range(target - len(active)):
+            session = aiohttp.ClientSession(connector=connector, connector_owner=False, timeout=timeout,
+                                            cookie_jar=aiohttp.CookieJar(unsafe=True))
+            user = VirtualUser(index, session, recorder, images, args)
+            users[user] = asyncio.create_task(run_user(user))
+            index += 1
+
+        if elapsed >= next_flush:
+            point = recorder.flush(min(target, len(users)))
+            print(f"t={point['t']:>6.0f}s users={point['users']:>4} rps={point['rps']:>7.1f} "
+                  f"errors={point['errors']:>4} p50={point['p50_ms']:>7.0f}ms p95={point['p95_ms']:>7.0f}ms")
+            next_flush += args.interval
+        await asyncio.sleep(0.2)
+
+    for user in users:
+        user.stopping = True
+    if users:
+        _, pending = await asyncio.wait(users.values(), timeout=args.timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    await connector.close()
+
+    summary = recorder.summary()
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"run_id": args.run_id, "profile": args.profile, "summary": summary,
+                       "timeline": recorder.timeline}, f, indent=2)
+        print(f"\nSaved {args.json}")
+
+    requests = sum(stats["requests"] for stats in summary.values())
+    errors = sum(recorder.errors.values())
+    if requests and errors / requests > args.max_error_rate:
+        print(f"Error rate {errors / requests:.2%} is above {args.max_error_rate:.2%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="User flow load test for auth, client and model services")
+    parser.add_argument("--auth-url", default="http://localhost:8001")
+    parser.add_argument("--client-url", default="http://localhost:8002")
+    parser.add_argument("--model-url", default="http://localhost:8003")
+    parser.add_argument("--profile", default="30s:5,60s:5,60s:20,30s:0", help="ramp stages duration:users, e.g. 30s:5,2m:40")
+    parser.add_argument("--interval", type=float, default=5.0, help="timeline interval, seconds")
+    parser.add_argument("--upload-ratio", type=float, default=0.3, help="share of iterations that upload and predict")
+    parser.add_argument("--files", type=int, default=2, help="files per upload")
+    parser.add_argument("--history-pages", type=int, default=2)
+    parser.add_argument("--detail-retries", type=int, default=5)
+    parser.add_argument("--think", type=float, default=1.0, help="mean pause between iterations, seconds")
+    parser.add_argument("--width", type=int, default=8960)
+    parser.add_argument("--height", type=int, default=640)
+    parser.add_argument("--distinct-images", type=int, default=4)
+    parser.add_argument("--cached", action="store_true", help="upload identical images to hit the prediction cache")
+    parser.add_argument("--timeout", type=float, default=120.0, help="request timeout, seconds")
+    parser.add_argument("--password", default="loadtest-password")
+    parser.add_argument("--run-id", default=uuid.uuid4().hex[:8], help="suffix of generated user emails")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="exit with 1 above this error rate")
+    parser.add_argument("--create-buckets", action="store_true", help="create S3 buckets from configs/.env first")
+    parser.add_argument("--json", help="write summary and timeline to this file")
+    sys.exit(asyncio.run(main(parser.parse_args())))
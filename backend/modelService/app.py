@@ -1,9 +1,30 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, status
+from common.compression import CompressionMiddleware
+from common.metrics import setup_metrics
+from common.responses import JSONResponse
+from configs.config import settings
 import uvicorn
-from .modelseg.router import router as modelseg
+from .modelseg.router import router as modelseg, STARTUP
 
-app = FastAPI(title="ModelService")
+app = FastAPI(title="ModelService", default_response_class=JSONResponse)
+if settings.RESPONSE_COMPRESSION:
+    app.add_middleware(CompressionMiddleware)
+setup_metrics(app)
 app.include_router(modelseg, tags=["model"], prefix="/model")
 
+@app.get("/health/live", tags=["health"])
+async def health_live():
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"status": "alive"}
+    )
+
+@app.get("/health/ready", tags=["health"])
+async def health_ready():
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if STARTUP["status"] == "ready" else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content=STARTUP
+    )
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8003)
@@ -0,0 +1,152 @@
+import importlib.util
+import os
+from pathlib import Path
+import shutil
+import numpy as np
+import torch
+from ultralytics import YOLO
+from configs.config import settings
+
+BACKENDS = ("torch", "onnxruntime", "openvino")
+PRECISIONS = ("fp32", "fp16", "int8")
+# Пакеты экспорта и запуска (закреплены в configs/requirements.txt)
+BACKEND_PACKAGES = {"onnxruntime": ("onnx", "onnxslim", "onnxruntime"), "openvino": ("openvino",)}
+
+
+def _check_packages():
+    packages = BACKEND_PACKAGES[settings.INFERENCE_BACKEND]
+    if settings.INFERENCE_BACKEND == "openvino" and settings.INFERENCE_PRECISION == "int8":
+        packages += ("nncf",)
+    missing = [name for name in packages if importlib.util.find_spec(name) is None]
+    if missing:
+        raise ImportError(f"INFERENCE_BACKEND={settings.INFERENCE_BACKEND} ({settings.INFERENCE_PRECISION}) "
+                          f"requires {', '.join(missing)}: pip install -r configs/requirements.txt")
+
+
+def _exported_path(weights: Path):
+    suffix = f"{settings.INFERENCE_BACKEND}_{settings.INFERENCE_PRECISION}"
+    if settings.INFERENCE_BACKEND == "onnxruntime":
+        return weights.with_name(f"{weights.stem}_{suffix}.onnx")
+    # Ultralytics определяет формат OpenVINO по суффиксу папки
+    return weights.with_name(f"{weights.stem}_{suffix}_openvino_model")
+
+
+def _quantize_onnx(src: Path, dst: Path):
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(str(src), str(dst), weight_type=QuantType.QUInt8)
+    # Метаданные (names, stride, imgsz) нужны AutoBackend, квантизация их не переносит
+    original, quantized = onnx.load(str(src)), onnx.load(str(dst))
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(original.metadata_props)
+    onnx.save(quantized, str(dst))
+
+
+def resolve_weights():
+    """
+    Возвращает путь к весам для выбранного INFERENCE_BACKEND. Для onnxruntime
+    и openvino модель экспортируется один раз и переиспользуется, пока
+    экспорт новее исходного .pt.
+    """
+    if settings.INFERENCE_BACKEND not in BACKENDS:
+        raise ValueError(f"Unknown INFERENCE_BACKEND: {settings.INFERENCE_BACKEND}")
+    if settings.INFERENCE_PRECISION not in PRECISIONS:
+        raise ValueError(f"Unknown INFERENCE_PRECISION: {settings.INFERENCE_PRECISION}")
+
+    weights = Path(settings.PATHTOMODEL)
+    if settings.INFERENCE_BACKEND == "torch":
+        return str(weights)
+    _check_packages()
+
+    target = _exported_path(weights)
+    if target.exists() and target.stat().st_mtime >= weights.stat().st_mtime:
+        return str(target)
+
+    print(f"Exporting {weights} to {settings.INFERENCE_BACKEND} ({settings.INFERENCE_PRECISION})")
+    half = settings.INFERENCE_PRECISION == "fp16"
+    int8 = settings.INFERENCE_PRECISION == "int8"
+    model = YOLO(str(weights))
+    if settings.INFERENCE_BACKEND == "onnxruntime":
+        # dynamic=True: батч из BatchScheduler имеет переменный размер
+        exported = Path(model.export(format="onnx", dynamic=True, half=half, simplify=True))
+        if int8:
+            _quantize_onnx(exported, target)
+            os.remove(exported)
+        else:
+            os.replace(exported, target)
+    else:
+        exported = Path(model.export(format="openvino", dynamic=True, half=half, int8=int8,
+                                     data=settings.INFERENCE_CALIBRATION_DATA or None))
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(exported, target)
+    return str(target)
+
+
+def _tune_backend(backend, weights: str):
+    """Пересоздаёт сессию движка с нужным числом потоков (AutoBackend их не настраивает)."""
+    intra, inter = settings.INFERENCE_INTRA_OP_THREADS, settings.INFERENCE_INTER_OP_THREADS
+    if settings.INFERENCE_BACKEND == "onnxruntime" and (intra or inter):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra:
+            options.intra_op_num_threads = intra
+        if inter:
+            options.inter_op_num_threads = inter
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+        backend.session = onnxruntime.InferenceSession(weights, options, providers=backend.session.get_providers())
+    elif settings.INFERENCE_BACKEND == "openvino" and (intra or inter):
+        import openvino as ov
+
+        core = ov.Core()
+        xml = next(Path(weights).glob("*.xml"))
+        config = {"PERFORMANCE_HINT": "THROUGHPUT"}
+        if intra:
+            config["INFERENCE_NUM_THREADS"] = intra
+        if inter:
+            config["NUM_STREAMS"] = inter
+        backend.ov_compiled_model = core.compile_model(core.read_model(xml), "CPU", config)
+
+
+def _first_output(y):
+    while isinstance(y, (list, tuple)):
+        y = y[0]
+    return y.detach().cpu().float().numpy() if isinstance(y, torch.Tensor) else np.asarray(y, dtype=np.float32)
+
+
+def check_parity(model):
+    """
+    Сравнивает сырой выход выбранного движка с PyTorch на одном и том же
+    входном тензоре. Бросает RuntimeError, если относительное расхождение
+    больше INFERENCE_PARITY_TOLERANCE.
+    """
+    reference = YOLO(settings.PATHTOMODEL)
+    reference.predict(np.zeros((64, 64, 3), dtype=np.uint8), verbose=False)
+
+    backend, torch_backend = model.predictor.model, reference.predictor.model
+    imgsz = model.predictor.imgsz
+    generator = torch.Generator().manual_seed(0)
+    x = torch.rand((1, 3, imgsz[0], imgsz[1]), generator=generator).to(backend.device)
+
+    y = _first_output(backend(x.half() if backend.fp16 else x))
+    y_ref = _first_output(torch_backend(x.to(torch_backend.device)))
+    diff = float(np.abs(y - y_ref).max() / max(np.abs(y_ref).max(), 1e-9))
+    print(f"Parity {settings.INFERENCE_BACKEND}/{settings.INFERENCE_PRECISION} vs torch: max relative diff {diff:.5f}")
+    if diff > settings.INFERENCE_PARITY_TOLERANCE:
+        raise RuntimeError(f"Parity check failed: {diff:.5f} > {settings.INFERENCE_PARITY_TOLERANCE}")
+    return diff
+
+
+def load_model(weights: str):
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = YOLO(weights, task="segment")
+    if settings.INFERENCE_BACKEND == "torch":
+        model.to(device)
+        return model
+
+    # Первый вызов создаёт predictor и AutoBackend, после чего сессию можно перенастроить
+    model.predict(np.zeros((64, 64, 3), dtype=np.uint8), verbose=False)
+    _tune_backend(model.predictor.model, weights)
+    return model
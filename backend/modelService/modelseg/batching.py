@@ -0,0 +1,116 @@
+import asyncio
+from common import metrics
+from common.metrics import stage
+from configs.config import settings
+from .errors import QueueFullError
+
+
+class BatchScheduler:
+    """
+    Динамический микробатчинг поверх InferencePool: плитки параллельных
+    запросов копятся, пока не наберётся max_batch плиток или не истечёт
+    max_wait_ms, затем прогоняются одним вызовом predict. Каждый запрос
+    получает обратно результаты своих плиток в исходном порядке, поэтому
+    окна из split_img остаются корректными для processed_prediction.
+
+    Батч собирается только когда в пуле есть свободный воркер: пока пул
+    занят, плитки ждут в очереди планировщика и укрупняют следующий батч,
+    а переполнение очереди отсекается в predict, до постановки запроса.
+    """
+
+    def __init__(self, pool, max_batch: int, max_wait_ms: float, queue_size: int):
+        self._pool = pool
+        self._max_batch = max_batch
+        self._max_wait = max_wait_ms / 1000
+        self._queue_size = queue_size
+        self._queue = asyncio.Queue()
+        # Запрос, не поместившийся в предыдущий батч; открывает следующий
+        self._carry = None
+        self._slots = asyncio.Semaphore(pool.workers)
+        self._task = None
+        self._running = set()
+
+    @property
+    def pending(self):
+        return self._queue.qsize() + (self._carry is not None)
+
+    def start(self):
+        self._task = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def predict(self, tiles: list):
+        if self.pending >= self._queue_size:
+            raise QueueFullError()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((tiles, future))
+        return await future
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        if self._carry is not None:
+            batch, self._carry = [self._carry], None
+        else:
+            batch = [await self._queue.get()]
+        size = len(batch[0][0])
+        deadline = loop.time() + self._max_wait
+        while size < self._max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            # Запрос не делится между батчами: не влез целиком — ждёт следующего
+            if size + len(item[0]) > self._max_batch:
+                self._carry = item
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    async def _collect(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                batch = await self._next_batch()
+            except BaseException:
+                self._slots.release()
+                raise
+            # Пока батч считается, следующий уже собирается (если в пуле несколько воркеров)
+            task = asyncio.create_task(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: list):
+        tiles = [tile for item_tiles, _ in batch for tile in item_tiles]
+        metrics.BATCH_TILES.observe(len(tiles))
+        metrics.BATCH_REQUESTS.observe(len(batch))
+        try:
+            with stage("inference"):
+                results = await self._pool.predict(tiles)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        start = 0
+        for item_tiles, future in batch:
+            if not future.done():
+                future.set_result(results[start:start + len(item_tiles)])
+            start += len(item_tiles)
+
+
+def create_scheduler(pool):
+    return BatchScheduler(pool,
+                          max_batch=settings.BATCH_MAX_TILES,
+                          max_wait_ms=settings.BATCH_MAX_WAIT_MS,
+                          queue_size=settings.INFERENCE_QUEUE_SIZE)
@@ -0,0 +1,144 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import threading
+from fastapi.concurrency import run_in_threadpool
+from common.responses import json_dumps, json_loads
+from configs.config import settings
+
+
+def file_sha256(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tiler_config():
+    return {
+        "INFERENCE_BACKEND": settings.INFERENCE_BACKEND,
+        "INFERENCE_PRECISION": settings.INFERENCE_PRECISION,
+        "GRID_ROWS": settings.GRID_ROWS,
+        "GRID_COLS": settings.GRID_COLS,
+        "TILE_HEIGHT": settings.TILE_HEIGHT,
+        "TILE_WIDTH": settings.TILE_WIDTH,
+        "TILE_OVERLAP": settings.TILE_OVERLAP,
+        "TILE_EDGE_POLICY": settings.TILE_EDGE_POLICY,
+        "TILE_NMS_IOU": settings.TILE_NMS_IOU,
+        "TILE_STITCH": settings.TILE_STITCH,
+        "TILE_STITCH_TOLERANCE": settings.TILE_STITCH_TOLERANCE,
+        "MASK_SIMPLIFY_TOLERANCE": settings.MASK_SIMPLIFY_TOLERANCE,
+        "MASK_ROUND": settings.MASK_ROUND,
+        "MASK_DECIMALS": settings.MASK_DECIMALS,
+    }
+
+
+class PredictionCache:
+    """
+    Кэш предсказаний с ключом (SHA-256 изображения, хэш весов, конфиг тайлера
+    и движка инференса).
+    Два уровня: LRU в памяти, ограниченный по объёму, и JSON-файлы на диске,
+    ограниченные disk_max_bytes: при записи удаляются файлы с самым старым
+    mtime (чтение с диска обновляет mtime). Хэш весов и конфига входит в префикс ключа, поэтому при смене
+    PATHTOMODEL старые записи просто перестают находиться, а при старте
+    удаляются с диска.
+    """
+
+    def __init__(self, max_bytes: int, cache_dir: str, disk_max_bytes: int):
+        config = json.dumps(tiler_config(), sort_keys=True).encode()
+        self.prefix = f"{file_sha256(settings.PATHTOMODEL)[:16]}-{hashlib.sha256(config).hexdigest()[:8]}"
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        # Файлы на диске в порядке mtime: key -> размер; запись идёт из пула потоков
+        self._files = OrderedDict()
+        self._disk_size = 0
+        self._disk_lock = threading.Lock()
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            files = []
+            for entry in os.scandir(self.cache_dir):
+                if not entry.name.startswith(self.prefix) or not entry.name.endswith(".json"):
+                    os.remove(entry.path)
+                    continue
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-len(".json")], stat.st_size))
+            for _, key, size in sorted(files):
+                self._files[key] = size
+                self._disk_size += size
+            self._evict_disk()
+
+    def key(self, bytes_img: bytes):
+        return f"{self.prefix}-{hashlib.sha256(bytes_img).hexdigest()}"
+
+    def _path(self, key: str):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _remember(self, key: str, data: bytes):
+        if key in self._items:
+            self._size -= len(self._items.pop(key))
+        if len(data) > self.max_bytes:
+            return
+        self._items[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _evict_disk(self):
+        with self._disk_lock:
+            while self._disk_size > self.disk_max_bytes and self._files:
+                key, size = self._files.popitem(last=False)
+                self._disk_size -= size
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+
+    def _read_disk(self, key: str):
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            return None
+        with self._disk_lock:
+            if key in self._files:
+                self._files.move_to_end(key)
+        return data
+
+    def _write_disk(self, key: str, data: bytes):
+        if len(data) > self.disk_max_bytes:
+            return
+        tmp_path = self._path(key) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        with self._disk_lock:
+            self._disk_size += len(data) - self._files.pop(key, 0)
+            self._files[key] = len(data)
+        self._evict_disk()
+
+    async def get(self, key: str):
+        data = self._items.get(key)
+        if data is not None:
+            self._items.move_to_end(key)
+        elif self.cache_dir:
+            data = await run_in_threadpool(self._read_disk, key)
+            if data is not None:
+                self._remember(key, data)
+        if data is None:
+            return None
+        # Каждый вызов получает свою копию: pred дальше дополняется в роутере
+        return json_loads(data)
+
+    async def put(self, key: str, pred: dict):
+        data = json_dumps(pred)
+        self._remember(key, data)
+        if self.cache_dir:
+            await run_in_threadpool(self._write_disk, key, data)
@@ -0,0 +1,76 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import queue
+import torch
+from configs.config import settings
+from .backends import check_parity, load_model, resolve_weights
+from .errors import QueueFullError
+
+
+def _predict(model, tiles: list):
+    return model.predict(tiles, verbose=False)
+
+
+def configure_torch():
+    # Настройки потоков torch действуют на весь процесс и должны
+    # выставляться до первой загрузки модели.
+    if settings.INFERENCE_INTRA_OP_THREADS:
+        torch.set_num_threads(settings.INFERENCE_INTRA_OP_THREADS)
+    if settings.INFERENCE_INTER_OP_THREADS:
+        torch.set_num_interop_threads(settings.INFERENCE_INTER_OP_THREADS)
+
+
+class InferencePool:
+    """
+    Пул потоков для блокирующего инференса вне event loop.
+    У каждого потока своя копия модели (YOLO.predict не потокобезопасен),
+    число задач в работе и в очереди ограничено — при переполнении
+    run бросает QueueFullError.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        weights = resolve_weights()
+        self._models = queue.SimpleQueue()
+        for idx in range(workers):
+            model = load_model(weights)
+            if idx == 0 and settings.INFERENCE_PARITY_CHECK and settings.INFERENCE_BACKEND != "torch":
+                check_parity(model)
+            self._models.put(model)
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self._limit = workers + queue_size
+        self._pending = 0
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def _call(self, fn, args, kwargs):
+        model = self._models.get()
+        try:
+            return fn(model, *args, **kwargs)
+        finally:
+            self._models.put(model)
+
+    async def run(self, fn, *args, **kwargs):
+        """Выполняет fn(model, *args, **kwargs) в пуле и ждёт результат."""
+        if self._pending >= self._limit:
+            raise QueueFullError()
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(self._call, fn, args, kwargs))
+        finally:
+            self._pending -= 1
+
+    async def predict(self, tiles: list):
+        return await self.run(_predict, tiles)
+
+    async def warmup(self, tiles: list, runs: int):
+        """Прогревает каждую копию модели батчем плиток рабочего размера."""
+        for _ in range(runs):
+            await asyncio.gather(*(self.predict(tiles) for _ in range(self.workers)))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import time
+import uuid
+from common import metrics
+from configs.config import settings
+
+
+class PredictJob:
+    """
+    Задача предсказания для списка файлов. Файлы обрабатываются параллельно
+    (не больше JOB_FILE_CONCURRENCY одновременно), результаты копятся
+    в events в порядке готовности и раздаются подписчикам stream().
+    """
+
+    def __init__(self, user_id: uuid.UUID, files_id: list):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.status = "queued"
+        self.files = {str(file_id): {"status": "queued"} for file_id in files_id}
+        self.events = []
+        self.created_at = time.time()
+        self.finished_at = None
+        self._changed = asyncio.Condition()
+
+    @property
+    def done(self):
+        return self.status in ("done", "failed")
+
+    def info(self):
+        completed = sum(1 for f in self.files.values() if f["status"] in ("done", "failed"))
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": len(self.files),
+            "completed": completed,
+            "files": self.files,
+        }
+
+    async def _publish(self, event: dict):
+        async with self._changed:
+            if event is not None:
+                self.events.append(event)
+            self._changed.notify_all()
+
+    async def run(self, worker):
+        self.status = "running"
+        semaphore = asyncio.Semaphore(settings.JOB_FILE_CONCURRENCY)
+
+        async def process(file_id: str):
+            async with semaphore:
+                self.files[file_id]["status"] = "running"
+                try:
+                    pred = await worker(uuid.UUID(file_id))
+                except Exception as e:
+                    self.files[file_id] = {"status": "failed", "message": str(e)}
+                    await self._publish({"file_id": file_id, "status": "failed", "message": str(e)})
+                    return
+                self.files[file_id] = {"status": "done"}
+                await self._publish({"file_id": file_id, "status": "done", "pred": pred})
+
+        metrics.JOBS_ACTIVE.inc()
+        try:
+            await asyncio.gather(*(process(file_id) for file_id in self.files))
+        finally:
+            metrics.JOBS_ACTIVE.dec()
+        failed = all(f["status"] == "failed" for f in self.files.values())
+        self.status = "failed" if failed and self.files else "done"
+        self.finished_at = time.time()
+        await self._publish(None)
+
+    async def stream(self):
+        """NDJSON: по строке на каждый готовый файл, отдаётся сразу по готовности."""
+        sent = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: sent < len(self.events) or self.done)
+                pending = self.events[sent:]
+            for event in pending:
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+            sent += len(pending)
+            if self.done and sent == len(self.events):
+                return
+
+
+class JobManager:
+    def __init__(self):
+        self._jobs = {}
+        self._tasks = set()
+
+    def submit(self, user_id: uuid.UUID, files_id: list, worker):
+        self._cleanup()
+        job = PredictJob(user_id=user_id, files_id=files_id)
+        self._jobs[job.id] = job
+        self.spawn(job.run(worker))
+        return job
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def get(self, job_id: str, user_id: uuid.UUID):
+        job = self._jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    def _cleanup(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.done and now - job.finished_at > settings.JOB_TTL_SECONDS]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+JOBS = JobManager()
@@ -0,0 +1,100 @@
+import uuid
+import cv2
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image
+from common.metrics import stage
+from configs.config import settings
+from dbmodels.crud import find_file_by_id, get_history_by_user_file_id
+from dbmodels.database import async_session_maker
+from .utils import decode_image, download_image, gen_pdf, report_image_box
+
+# Цвета классов (BGR), по кругу
+PALETTE = [(56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207),
+           (10, 249, 72), (23, 204, 146), (134, 219, 61), (52, 147, 26), (187, 212, 0)]
+
+
+def class_color(num_class: int):
+    return PALETTE[int(num_class) % len(PALETTE)]
+
+
+def print_scale(height: int, width: int):
+    """Масштаб, при котором изображение на странице отчёта имеет ровно REPORT_DPI."""
+    box_width, box_height = report_image_box()
+    max_width = box_width / 25.4 * settings.REPORT_DPI
+    max_height = box_height / 25.4 * settings.REPORT_DPI
+    return min(1.0, max_width / width, max_height / height)
+
+
+def draw_prediction(image: np.ndarray, masks: list, num_classes: list):
+    """
+    Накладывает полигоны дефектов за один проход: изображение сначала
+    уменьшается до разрешения печати, все вершины масштабируются одной
+    операцией над общим массивом, а заливка и контуры рисуются одним
+    вызовом cv2 на класс. Возвращает RGB для PDF.
+    """
+    height, width = image.shape[:2]
+    scale = print_scale(height, width)
+    if scale < 1:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    else:
+        image = image.copy()
+
+    polygons = [np.asarray(mask, dtype=np.float32).reshape(-1, 2) for mask in masks]
+    keep = [i for i, polygon in enumerate(polygons) if len(polygon) >= 3]
+    if keep:
+        lengths = [len(polygons[i]) for i in keep]
+        points = np.rint(np.concatenate([polygons[i] for i in keep]) * scale).astype(np.int32)
+        polygons = np.split(points, np.cumsum(lengths)[:-1])
+
+        by_class = {}
+        for polygon, i in zip(polygons, keep):
+            by_class.setdefault(int(num_classes[i]), []).append(polygon)
+
+        overlay = image.copy()
+        for num_class, class_polygons in by_class.items():
+            cv2.fillPoly(overlay, class_polygons, class_color(num_class))
+        cv2.addWeighted(overlay, 0.4, image, 0.6, 0, dst=image)
+        for num_class, class_polygons in by_class.items():
+            cv2.polylines(image, class_polygons, True, class_color(num_class), 1)
+
+    return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+
+
+def render_report(bytes_img: bytes, pred: dict):
+    image = decode_image(bytes_img)
+    return gen_pdf(pred, draw_prediction(image, pred["masks"], pred["num_classes"]))
+
+
+async def generate_report(s3, user_id: uuid.UUID, file_id: uuid.UUID):
+    """
+    Строит PDF по сохранённому предсказанию и оригиналу из S3, загружает его
+    в бакет отчётов и возвращает публичный URL.
+    """
+    async with async_session_maker() as db:
+        prediction = await get_history_by_user_file_id(user_id=user_id, file_id=file_id, db=db)
+        path_to_image = await find_file_by_id(id=file_id, db=db)
+    if prediction is None or path_to_image is None:
+        raise ValueError("Prediction or file not found")
+
+    pred = {
+        "masks": prediction.masks,
+        "num_classes": prediction.num_classes,
+        "classes": prediction.classes,
+        "confs": prediction.confs,
+    }
+    bytes_img = await download_image(s3=s3, path_to_image=path_to_image)
+    with stage("pdf"):
+        pdf_contents = await run_in_threadpool(render_report, bytes_img, pred)
+
+    name_pdf = f"{uuid.uuid4().hex}.pdf"
+    await s3.put_object(
+        Bucket=settings.S3_BUCKET_NAME_PDF,
+        Key=name_pdf,
+        Body=pdf_contents,
+        ContentLength=len(pdf_contents),
+        ContentType="application/pdf",
+        ACL='public-read'
+    )
+    return f"{settings.S3_PUBLIC_URL}/{settings.S3_BUCKET_NAME_PDF}/{name_pdf}"
@@ -1,40 +1,154 @@
+import asyncio
 from contextlib import asynccontextmanager
-import io
-import os
-import shutil
+import time
 import uuid
-import requests
-import cv2
 from fastapi import BackgroundTasks, Depends, FastAPI
-from fastapi.responses import JSONResponse
-import numpy as np
-import torch
-from PIL import Image
-from ultralytics import YOLO
+from fastapi.concurrency import run_in_threadpool
+from botocore.exceptions import ClientError
+from fastapi.responses import RedirectResponse, StreamingResponse
+from common import metrics
+from common.metrics import current_request_id, stage
+from common.responses import JSONResponse
 from authService.auth.utils import get_current_user
-from dbmodels.schemas import UserBase, info_file, info_prediction
-from dbmodels.crud import add_prediction_to_file, change_prediction, find_file_by_id
-from dbmodels.database import db_dependency, s3_dependency
+from dbmodels.schemas import UserBase, info_file, info_prediction, info_prediction_patch
+from dbmodels.crud import add_predictions_to_files, change_prediction, enqueue_report, enqueue_reports, find_files_by_ids, get_report_job, get_report_path, patch_prediction
+from dbmodels.errors import CoordinateRangeError, DetectionNotFoundError, StalePredictionError
+from dbmodels.database import async_session_maker, db_dependency, engine, get_s3_client, release_connection, s3_dependency, start_s3_client, stop_s3_client
 from fastapi import APIRouter, status
-from .utils import merge_and_create_pdf, processed_prediction, split_img
+from .batching import create_scheduler
+from .cache import PredictionCache
+from .errors import QueueFullError
+from .jobs import JOBS
 from configs.config import settings
 
-MODEL = None
+# torch, ultralytics, cv2 и fpdf импортируются лениво (в startup_model и
+# обработчиках), чтобы импорт приложения и health-проверки были быстрыми.
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    global MODEL
+POOL = None
+BATCHER = None
+CACHE = None
+STARTUP = {"status": "starting"}
+
+async def startup_model():
+    """Загрузка модели и прогрев; сервис считается готовым только после прогрева."""
+    global POOL, BATCHER, CACHE
+    started = time.perf_counter()
     try:
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        MODEL = YOLO(settings.PATHTOMODEL)
-        MODEL.to(device)
+        from .inference import InferencePool, configure_torch
+        from .utils import split_img
+        import numpy as np
+
+        configure_torch()
+        POOL = await run_in_threadpool(InferencePool, workers=settings.INFERENCE_WORKERS, queue_size=settings.INFERENCE_QUEUE_SIZE)
+        STARTUP["load_seconds"] = round(time.perf_counter() - started, 3)
+
+        warmup_started = time.perf_counter()
+        image = np.zeros((settings.WARMUP_IMAGE_HEIGHT, settings.WARMUP_IMAGE_WIDTH, 3), dtype=np.uint8)
+        tiles, _ = split_img(combined_image=image)
+        await POOL.warmup(tiles[:settings.BATCH_MAX_TILES], runs=settings.WARMUP_RUNS)
+        STARTUP["warmup_seconds"] = round(time.perf_counter() - warmup_started, 3)
+
+        if settings.PREDICT_CACHE_ENABLED:
+            CACHE = await run_in_threadpool(PredictionCache,
+                                            max_bytes=settings.PREDICT_CACHE_MAX_MB * 1024 * 1024,
+                                            cache_dir=settings.PREDICT_CACHE_DIR,
+                                            disk_max_bytes=settings.PREDICT_CACHE_DISK_MAX_MB * 1024 * 1024)
+        BATCHER = create_scheduler(POOL)
+        BATCHER.start()
+        metrics.INFERENCE_QUEUE_DEPTH.set_function(lambda: BATCHER.pending if BATCHER is not None else 0)
+        metrics.INFERENCE_POOL_PENDING.set_function(lambda: POOL.pending if POOL is not None else 0)
+        STARTUP["status"] = "ready"
     except Exception as e:
+        STARTUP["status"] = "failed"
+        STARTUP["error"] = str(e)
         print(f"Error loading model: {str(e)}")
+    STARTUP["startup_seconds"] = round(time.perf_counter() - started, 3)
+    print(f"Model startup: {STARTUP}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global POOL, BATCHER, CACHE
+    await start_s3_client()
+    startup_task = asyncio.create_task(startup_model())
     yield
-    del MODEL
+    startup_task.cancel()
+    await asyncio.gather(startup_task, return_exceptions=True)
+    await JOBS.stop()
+    if BATCHER is not None:
+        await BATCHER.stop()
+    if POOL is not None:
+        POOL.shutdown()
+    POOL, BATCHER, CACHE = None, None, None
+    await stop_s3_client()
+    await engine.dispose()
 
 router = APIRouter(lifespan=lifespan)
 
+async def predict_image(bytes_img: bytes):
+    from .utils import decode_image, processed_prediction, split_img
+
+    with stage("decode"):
+        combined_image = await run_in_threadpool(decode_image, bytes_img)
+    with stage("split"):
+        tiles, windows = split_img(combined_image=combined_image)
+    with stage("predict"):
+        result = await BATCHER.predict(tiles)
+
+    height, width, _ = combined_image.shape
+    with stage("postprocess"):
+        return await run_in_threadpool(processed_prediction, result, windows, height, width)
+
+async def predict_cached(bytes_img: bytes):
+    """Предсказание с учётом кэша по содержимому изображения."""
+    key = None
+    if CACHE is not None:
+        key = await run_in_threadpool(CACHE.key, bytes_img)
+        pred = await CACHE.get(key)
+        metrics.PREDICT_CACHE.labels("miss" if pred is None else "hit").inc()
+        if pred is not None:
+            return pred
+
+    pred = await predict_image(bytes_img)
+    if key is not None:
+        await CACHE.put(key, pred)
+    return pred
+
+def report_url(file_id):
+    # PDF строится воркером отчётов; этот адрес отдаёт его, когда он готов
+    return f"{settings.REPORT_PUBLIC_URL}/{file_id}"
+
+async def store_predictions(user_id: uuid.UUID, predictions: dict):
+    """Все предсказания запроса {file_id: pred} — одним upsert и одной постановкой отчётов."""
+    if not predictions:
+        return
+    with stage("db"):
+        async with async_session_maker() as db:
+            await add_predictions_to_files(user_id=user_id, predictions=predictions, db=db)
+            if settings.REPORT_EAGER:
+                await enqueue_reports(user_id=user_id, files_id=list(predictions), db=db, request_id=current_request_id())
+
+async def predict_file_job(file_id: uuid.UUID, user_id: uuid.UUID):
+    async with async_session_maker() as db:
+        paths_to_image = await find_files_by_ids(ids=[file_id], user_id=user_id, db=db)
+    if file_id not in paths_to_image:
+        raise ValueError("File not found")
+    path_to_image = paths_to_image[file_id]
+
+    from .utils import download_image
+
+    bytes_img = await download_image(s3=await get_s3_client(), path_to_image=path_to_image)
+
+    while True:
+        try:
+            pred = await predict_cached(bytes_img)
+            break
+        except QueueFullError:
+            await asyncio.sleep(settings.INFERENCE_RETRY_AFTER)
+
+    pred["path_to_report"] = report_url(file_id)
+    await store_predictions(user_id=user_id, predictions={file_id: pred})
+    return pred
+
 @router.post("/predict")
 async def get_predict(info: info_file, background_tasks: BackgroundTasks, user: UserBase = Depends(get_current_user), db: db_dependency = db_dependency, s3: s3_dependency = s3_dependency):
     if not user or not user.is_active:
@@ -43,75 +157,120 @@ async def get_predict(info: info_file, background_tasks: BackgroundTasks, user:
             content={"message": "User not found or inactive"},
         )
 
-    if MODEL is None:
+    if BATCHER is None:
         return JSONResponse(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             content={"message": "Model not loaded"},
         )
     
-    dict_predict = {}
-    for file in info.files_id:
-        path_to_image = await find_file_by_id(id=file, db=db)
-        name_image = path_to_image.split("/")[-1].split(".")[0]
-        response = requests.get(path_to_image)
-        if response.status_code != 200:
-            return JSONResponse(
-                status_code=response.status_code,
-                content={"message": f"Failed to get image, status code: {response.status_code}"},
-            )
-        bytes_img = response.content
+    from .utils import download_image
 
-        try:
-            #image = await download_image_bytes(url=path_to_image)
-            combined_image = cv2.cvtColor(np.array(Image.open(io.BytesIO(bytes_img)).convert("RGB")), cv2.COLOR_RGB2BGR)
-            path_images_list = split_img(combined_image=combined_image, name_image=name_image)
-            result = MODEL.predict(path_images_list, save=True, project="./runs")
+    files_id = list(dict.fromkeys(info.files_id))
+    with stage("db_lookup"):
+        paths_to_image = await find_files_by_ids(ids=files_id, user_id=user.id, db=db)
+    # Дальше только S3 и инференс, результат пишет фоновая задача своей сессией
+    await release_connection(db)
+    missing = [str(file) for file in files_id if file not in paths_to_image]
+    if missing:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": f"Files not found: {', '.join(missing)}"},
+        )
+    try:
+        images = await asyncio.gather(*(download_image(s3=s3, path_to_image=paths_to_image[file]) for file in files_id))
+    except ClientError as e:
+        status_code = e.response["ResponseMetadata"]["HTTPStatusCode"]
+        return JSONResponse(
+            status_code=status_code,
+            content={"message": f"Failed to get image, status code: {status_code}"},
+        )
 
-            part_height, part_width, _ = combined_image.shape
-            pred = processed_prediction(result, part_height, part_width)
+    dict_predict = {}
+    # Задача выполнится после ответа, поэтому сохранит и то, что успели предсказать до ошибки
+    predictions = {}
+    background_tasks.add_task(store_predictions, user_id=user.id, predictions=predictions)
+    for file, bytes_img in zip(files_id, images):
+        try:
+            pred = await predict_cached(bytes_img)
+            pred["path_to_report"] = report_url(file)
             dict_predict[file.__str__()] = pred
+            predictions[file] = pred
 
-            #output_pdf = f"..{settings.FILE_SAVE_FOLDER}/{uuid.uuid4().hex}.pdf"
-            name_pdf = f"{uuid.uuid4().hex}.pdf"
-            output_pdf = f"{settings.S3_PUBLIC_URL}/{settings.S3_BUCKET_NAME_PDF}/{name_pdf}"
-            pred["path_to_report"] = output_pdf
-
-            background_tasks.add_task(
-                add_prediction_to_file,
-                file_id=file.__str__(),
-                user_id=user.id,
-                masks=pred["masks"],
-                boxes=pred["boxes"],
-                num_classes=pred["num_classes"],
-                classes=pred["classes"],
-                confs=pred["confs"],
-                path_to_report=output_pdf,
-                db=db
-            )
-            print("Remove splited images")
-            for file_path in path_images_list:
-                background_tasks.add_task(os.remove, file_path)
-
-            background_tasks.add_task(
-                merge_and_create_pdf,
-                pred=pred,
-                input_dir=result[0].save_dir,
-                name_pdf=name_pdf,
-                s3=s3
+        except QueueFullError:
+            return JSONResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content={"message": "Inference queue is full, try again later"},
+                headers={"Retry-After": str(settings.INFERENCE_RETRY_AFTER)},
             )
-
         except Exception as e:
             return JSONResponse(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 content={"message": f"Prediction failed: {str(e)}"},
             )
-    print("Remove result from model")
-    background_tasks.add_task(shutil.rmtree, result[0].save_dir, ignore_errors=True)
     return JSONResponse(
         status_code=status.HTTP_200_OK,
         content=dict_predict
     )
 
+@router.post("/jobs")
+async def create_predict_job(info: info_file, user: UserBase = Depends(get_current_user)):
+    if not user or not user.is_active:
+        return JSONResponse(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={"message": "User not found or inactive"},
+        )
+
+    if BATCHER is None:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"message": "Model not loaded"},
+        )
+
+    user_id = user.id
+    job = JOBS.submit(user_id=user_id, files_id=info.files_id,
+                      worker=lambda file_id: predict_file_job(file_id=file_id, user_id=user_id))
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=job.info()
+    )
+
+@router.get("/jobs/{job_id}")
+async def get_predict_job(job_id: str, user: UserBase = Depends(get_current_user)):
+    if not user or not user.is_active:
+        return JSONResponse(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={"message": "User not found or inactive"},
+        )
+
+    job = JOBS.get(job_id=job_id, user_id=user.id)
+    if job is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": "Job not found"}
+        )
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content=job.info()
+    )
+
+@router.get("/jobs/{job_id}/stream")
+async def stream_predict_job(job_id: str, user: UserBase = Depends(get_current_user)):
+    if not user or not user.is_active:
+        return JSONResponse(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={"message": "User not found or inactive"},
+        )
+
+    job = JOBS.get(job_id=job_id, user_id=user.id)
+    if job is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": "Job not found"}
+        )
+
+    return StreamingResponse(job.stream(), media_type="application/x-ndjson")
+
 @router.patch("/update_predict")
 async def update_predict(info_predict: info_prediction, background_tasks: BackgroundTasks, user: UserBase = Depends(get_current_user), db: db_dependency = db_dependency):
     if not user or not user.is_active:
@@ -145,3 +304,106 @@ async def update_predict(info_predict: info_prediction, background_tasks: Backgr
         content={"message":"Успешно обновлена информация",
                  "rows_updated":result}
     )
+
+def validate_patch(patch: info_prediction_patch):
+    refs = set()
+    for detection in patch.modify + patch.remove:
+        if (detection.index is None) == (detection.id is None):
+            return "Each modified or removed detection needs exactly one of index or id"
+        ref = ("id", detection.id) if detection.id is not None else ("index", detection.index)
+        if ref in refs:
+            return f"Detection {ref[0]} {ref[1]} is referenced more than once"
+        refs.add(ref)
+    for detection in patch.modify:
+        if all(value is None for value in (detection.mask, detection.box, detection.num_class, detection.class_name, detection.conf)):
+            return "Modified detection has no changes"
+    for detection in patch.add:
+        if detection.mask is None or detection.box is None or detection.num_class is None or detection.class_name is None:
+            return "Added detection needs mask, box, num_class and class_name"
+        if detection.conf is None:
+            detection.conf = 1.0
+    return None
+
+@router.patch("/update_predict/detections")
+async def patch_predict(info_patch: info_prediction_patch, user: UserBase = Depends(get_current_user), db: db_dependency = db_dependency):
+    if not user or not user.is_active:
+        return JSONResponse(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={"message": "User not found or inactive"},
+        )
+
+    error = validate_patch(info_patch)
+    if error is not None:
+        return JSONResponse(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            content={"message": error}
+        )
+
+    try:
+        result = await patch_prediction(user_id=user.id, patch=info_patch, db=db)
+    except StalePredictionError as e:
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content={"message": "Prediction was changed by another edit, reload it and retry",
+                     "updated_at": e.updated_at.isoformat()}
+        )
+    except (DetectionNotFoundError, CoordinateRangeError) as e:
+        return JSONResponse(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            content={"message": str(e)}
+        )
+
+    if result is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message":"No matching record found to update"}
+        )
+
+    updated_at, added_ids = result
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"message":"Успешно обновлена информация",
+                 "updated_at": updated_at.isoformat(),
+                 "added_ids": added_ids}
+    )
+
+@router.get("/report/{file_id}")
+async def get_report(file_id: uuid.UUID, user: UserBase = Depends(get_current_user), db: db_dependency = db_dependency):
+    """
+    Отдаёт PDF-отчёт редиректом на S3. Если отчёта ещё нет, задача ставится
+    в очередь воркера (или остаётся в ней), а ответ ждёт её до REPORT_WAIT_SECONDS.
+    """
+    if not user or not user.is_active:
+        return JSONResponse(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={"message": "User not found or inactive"},
+        )
+
+    deadline = time.monotonic() + settings.REPORT_WAIT_SECONDS
+    enqueued = False
+    while True:
+        prediction = await get_report_path(user_id=user.id, file_id=file_id, db=db)
+        if prediction is None:
+            return JSONResponse(
+                status_code=status.HTTP_404_NOT_FOUND,
+                content={"message": "Prediction not found"}
+            )
+        if prediction.path_to_report:
+            return RedirectResponse(prediction.path_to_report)
+
+        job = await get_report_job(user_id=user.id, file_id=file_id, db=db)
+        # done без path_to_report — отчёт устарел (файл предсказан заново без REPORT_EAGER):
+        # воркер ставит путь и done одной транзакцией
+        if not enqueued and (job is None or job.status not in ("pending", "running")):
+            await enqueue_report(user_id=user.id, file_id=file_id, db=db, request_id=current_request_id())
+            enqueued = True
+        await db.commit()
+
+        if time.monotonic() >= deadline:
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content={"status": job.status if job is not None and not enqueued else "pending",
+                         "message": "Report is being generated, try again later"},
+                headers={"Retry-After": str(int(settings.REPORT_POLL_INTERVAL) + 1)},
+            )
+        await asyncio.sleep(settings.REPORT_POLL_INTERVAL)
@@ -0,0 +1,168 @@
+import math
+import cv2
+import numpy as np
+from configs.config import settings
+
+
+def _axis_windows(length: int, tile: int, overlap: int, policy: str):
+    tile = max(min(tile, length), 1)
+    stride = max(tile - overlap, 1)
+    starts = list(range(0, length - tile + 1, stride))
+    if starts[-1] + tile < length:
+        # Хвост, не кратный шагу: "shift" сдвигает последнее окно к краю
+        # (размер окна сохраняется), "crop" берёт укороченное окно.
+        starts.append(length - tile if policy == "shift" else starts[-1] + stride)
+    return [(start, min(start + tile, length)) for start in starts]
+
+
+def compute_windows(height: int, width: int):
+    """
+    Возвращает окна скользящего тайлера (N, 4) в формате x0, y0, x1, y1,
+    упорядоченные по строкам. Окна покрывают всё изображение целиком.
+    Размер окна по умолчанию выводится из GRID_ROWS × GRID_COLS.
+    """
+    tile_h = settings.TILE_HEIGHT or math.ceil(height / settings.GRID_ROWS)
+    tile_w = settings.TILE_WIDTH or math.ceil(width / settings.GRID_COLS)
+
+    rows = _axis_windows(height, tile_h, settings.TILE_OVERLAP, settings.TILE_EDGE_POLICY)
+    cols = _axis_windows(width, tile_w, settings.TILE_OVERLAP, settings.TILE_EDGE_POLICY)
+    return np.array([(x0, y0, x1, y1) for y0, y1 in rows for x0, x1 in cols], dtype=np.int64)
+
+
+def _box_iou(box: np.ndarray, boxes: np.ndarray):
+    xx1 = np.maximum(box[0], boxes[:, 0])
+    yy1 = np.maximum(box[1], boxes[:, 1])
+    xx2 = np.minimum(box[2], boxes[:, 2])
+    yy2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def nms(boxes: np.ndarray, confs: np.ndarray, class_ids: np.ndarray, iou_thr: float):
+    """
+    Классо-зависимый NMS: боксы разных классов разносятся смещением
+    по координатам, поэтому подавляются только пересечения внутри класса.
+    Возвращает индексы оставшихся детекций в порядке убывания уверенности.
+    """
+    if not len(boxes):
+        return np.empty(0, dtype=np.int64)
+    offset = class_ids[:, None].astype(np.float64) * (boxes.max() + 1)
+    shifted = boxes + offset
+
+    order = np.argsort(-confs, kind="stable")
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        if order.size == 1:
+            break
+        iou = _box_iou(shifted[i], shifted[order[1:]])
+        order = order[1:][iou <= iou_thr]
+    return np.array(keep, dtype=np.int64)
+
+
+def _cut_by_tile(boxes: np.ndarray, windows: np.ndarray, height: int, width: int, tol: float):
+    """Флаг: бокс касается внутренней (не совпадающей с краем изображения) границы своего окна."""
+    return (
+        ((boxes[:, 0] - windows[:, 0] <= tol) & (windows[:, 0] > 0))
+        | ((boxes[:, 1] - windows[:, 1] <= tol) & (windows[:, 1] > 0))
+        | ((windows[:, 2] - boxes[:, 2] <= tol) & (windows[:, 2] < width))
+        | ((windows[:, 3] - boxes[:, 3] <= tol) & (windows[:, 3] < height))
+    )
+
+
+def _find(parent: np.ndarray, i: int):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def _union_polygons(polygons: list, box: np.ndarray):
+    """
+    Контур объединения полигонов или None, если объединение распадается на
+    несколько частей: маска детекции — один полигон, и лишние части пропали бы.
+    """
+    x0, y0 = int(math.floor(box[0])), int(math.floor(box[1]))
+    w = int(math.ceil(box[2])) - x0 + 1
+    h = int(math.ceil(box[3])) - y0 + 1
+    canvas = np.zeros((h, w), dtype=np.uint8)
+    shifted = [np.round(p - (x0, y0)).astype(np.int32) for p in polygons if len(p)]
+    if not shifted:
+        return np.empty((0, 2), dtype=np.float32)
+    cv2.fillPoly(canvas, shifted, 1)
+    contours, _ = cv2.findContours(canvas, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if len(contours) != 1:
+        return None
+    return contours[0].reshape(-1, 2).astype(np.float32) + (x0, y0)
+
+
+def merge_detections(boxes: np.ndarray,
+                     confs: np.ndarray,
+                     class_ids: np.ndarray,
+                     tile_ids: np.ndarray,
+                     masks: list,
+                     windows: np.ndarray,
+                     height: int,
+                     width: int):
+    """
+    Объединяет детекции всех окон в глобальных координатах:
+    1) классо-зависимый NMS убирает дубли из зон перекрытия;
+    2) дефекты одного класса, разрезанные границей окна, склеиваются —
+       полигоны масок объединяются растеризацией, бокс и уверенность
+       берутся по группе.
+    """
+    keep = nms(boxes, confs, class_ids, settings.TILE_NMS_IOU)
+    boxes, confs, class_ids, tile_ids = boxes[keep], confs[keep], class_ids[keep], tile_ids[keep]
+    masks = [masks[i] for i in keep] if masks else []
+
+    parent = np.arange(len(boxes))
+    tol = settings.TILE_STITCH_TOLERANCE
+    cut = np.nonzero(_cut_by_tile(boxes, windows[tile_ids], height, width, tol))[0]
+    if settings.TILE_STITCH and cut.size > 1:
+        cb = boxes[cut]
+        touch = (
+            (cb[:, None, 0] <= cb[None, :, 2] + tol) & (cb[None, :, 0] <= cb[:, None, 2] + tol)
+            & (cb[:, None, 1] <= cb[None, :, 3] + tol) & (cb[None, :, 1] <= cb[:, None, 3] + tol)
+            & (class_ids[cut][:, None] == class_ids[cut][None, :])
+            & (tile_ids[cut][:, None] != tile_ids[cut][None, :])
+        )
+        for a, b in zip(*np.nonzero(np.triu(touch, k=1))):
+            ra, rb = _find(parent, cut[a]), _find(parent, cut[b])
+            if ra != rb:
+                parent[rb] = ra
+
+    roots = np.array([_find(parent, i) for i in range(len(boxes))], dtype=np.int64)
+    groups = {}
+    for i, root in enumerate(roots):
+        groups.setdefault(root, []).append(i)
+
+    out_boxes, out_confs, out_cls, out_masks = [], [], [], []
+    for root in sorted(groups, key=lambda r: -confs[r]):
+        members = groups[root]
+        if len(members) > 1:
+            group_box = np.concatenate([boxes[members, :2].min(axis=0), boxes[members, 2:].max(axis=0)])
+            union = _union_polygons([masks[i] for i in members], group_box) if masks else None
+            if union is not None or not masks:
+                out_boxes.append(group_box)
+                if masks:
+                    out_masks.append(union)
+                out_confs.append(confs[members].max())
+                out_cls.append(class_ids[root])
+                continue
+        # Одиночная детекция или группа, чьи маски не соприкасаются: остаются как есть
+        for i in members:
+            out_boxes.append(boxes[i])
+            if masks:
+                out_masks.append(masks[i])
+            out_confs.append(confs[i])
+            out_cls.append(class_ids[i])
+
+    return (
+        np.array(out_boxes, dtype=np.float32).reshape(-1, 4),
+        np.array(out_confs, dtype=np.float32),
+        np.array(out_cls, dtype=np.int64),
+        out_masks,
+    )
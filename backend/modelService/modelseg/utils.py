@@ -1,11 +1,12 @@
 from datetime import datetime
+import gc
 import io
-import re
 import cv2
 from cv2.typing import MatLike
+import numpy as np
+from common.metrics import stage
 from configs.config import settings
 from PIL import Image
-import os
 # from reportlab.lib.pagesizes import letter
 # from reportlab.pdfgen import canvas
 # from reportlab.lib.utils import ImageReader
@@ -14,6 +15,7 @@ import os
 from fpdf import FPDF, XPos, YPos
 from configs.config import settings
 from dbmodels.database import s3_dependency
+from .tiling import compute_windows, merge_detections
 
 # async def download_image_bytes(url: str):
 #     try:
@@ -32,43 +34,27 @@ from dbmodels.database import s3_dependency
 #             content={"message": f"Ошибка при скачивании изображения: {str(e)}"}
 #         )
 
-def merge_images(input_dir):
-    valid_extensions = {'.jpg', '.jpeg', '.png'}
-    files = [f for f in os.listdir(input_dir) 
-            if os.path.splitext(f)[1].lower() in valid_extensions]
-    
-    if True:
-        def natural_key(filename):
-            return [int(text) if text.isdigit() else text for text in re.split(r'(\d+)', filename)]
-
-        files.sort(key=natural_key)
-
-    if not files: raise ValueError("Нет изображений для склейки")
-
-    images = [Image.open(os.path.join(input_dir, f)) for f in files]
-    total_width = sum(img.width for img in images)
-    max_height = max(img.height for img in images)
-    
-    merged_image = Image.new('RGB', (total_width, max_height))
-    x_offset = 0
-    for img in images:
-        merged_image.paste(img, (x_offset, 0))
-        x_offset += img.width
-
-    return merged_image
-
-def gen_pdf(pred, merged_image: Image):
+def new_report_pdf():
     pdf = FPDF(orientation='L', unit='mm', format='A4')
-
     pdf.add_font(fname="DejaVuSans.ttf")
     pdf.set_font(family="DejaVuSans", size=12)
     pdf.add_page()
+    return pdf
+
+def report_image_box(pdf: FPDF = None):
+    """Максимальные ширина и высота изображения на странице отчёта, мм."""
+    if pdf is None:
+        pdf = FPDF(orientation='L', unit='mm', format='A4')
+    return pdf.w - pdf.l_margin - pdf.r_margin, pdf.h - pdf.t_margin - pdf.b_margin - 20
+
+def gen_pdf(pred, merged_image: Image):
+    pdf = new_report_pdf()
 
-    max_img_height = pdf.h - pdf.t_margin - pdf.b_margin - 20 
+    max_width, max_img_height = report_image_box(pdf)
     img_width, img_height = merged_image.size
     aspect_ratio = img_width / img_height
 
-    new_width = pdf.w - pdf.l_margin - pdf.r_margin
+    new_width = max_width
     new_height = new_width / aspect_ratio
 
     if new_height > max_img_height:
@@ -97,85 +83,128 @@ def gen_pdf(pred, merged_image: Image):
     pdf_buffer.close()
     return pdf_contents
 
-async def merge_and_create_pdf(pred, input_dir, name_pdf, s3: s3_dependency):
-    print("Merging images")
-    merged_image = merge_images(input_dir)
-    print("Generate PDF")
-    pdf_contents = gen_pdf(pred, merged_image)
-    print(f"Sending to S3 generated PDF({name_pdf})")
-    resp = await s3.put_object(
-        Bucket=settings.S3_BUCKET_NAME_PDF,
-        Key=name_pdf,
-        Body=pdf_contents,
-        ContentLength=len(pdf_contents),
-        ContentType="application/pdf",
-        ACL='public-read'
-    )
-    await s3.close()
-    
-
-def split_img(combined_image: MatLike, name_image: str):
+def split_img(combined_image: MatLike):
     """
-    Нарезает исходное изображение на GRID_ROWS × GRID_COLS равных плиток
-    и сохраняет их на диск. Возвращает список путей.
+    Нарезает исходное изображение скользящим окном (см. tiling.compute_windows).
+    Плитки — срезы (views) исходного массива без копирования и без записи
+    на диск, список передаётся в YOLO.predict одним батчем.
+    Возвращает плитки и их окна в глобальных координатах.
     """
     height, width, _ = combined_image.shape
-    part_h = height // settings.GRID_ROWS
-    part_w = width // settings.GRID_COLS
+    windows = compute_windows(height, width)
 
-    paths = []
-    for row in range(settings.GRID_ROWS):
-        for col in range(settings.GRID_COLS):
-            y0, y1 = row * part_h, (row + 1) * part_h
-            x0, x1 = col * part_w, (col + 1) * part_w
-            tile = combined_image[y0:y1, x0:x1]
+    tiles = [combined_image[y0:y1, x0:x1] for x0, y0, x1, y1 in windows]
+    return tiles, windows
 
-            save_path = f'../{settings.FILE_SAVE_FOLDER}/{name_image}_r{row}_c{col}.png'
-            cv2.imwrite(save_path, tile)
-            paths.append(save_path)
-    return paths
+def simplify_polygon(polygon: np.ndarray, tolerance: float):
+    """Дуглас-Пекер (cv2.approxPolyDP); вырожденный результат не заменяет исходный полигон."""
+    if len(polygon) < 3:
+        return polygon
+    simplified = cv2.approxPolyDP(polygon.reshape(-1, 1, 2).astype(np.float32), tolerance, True).reshape(-1, 2)
+    return simplified if len(simplified) >= 3 else polygon
 
-def processed_prediction(result: list, part_height, part_width):
-    masks_global, boxes_global = [], []
-    classes, class_ids, confs = [], [], []
-
-    part_h = part_height // settings.GRID_ROWS
-    part_w = part_width  // settings.GRID_COLS
+def serialize_polygons(polygons: list):
+    """
+    Перевод полигонов в списки для ответа и БД: упрощение (MASK_SIMPLIFY_TOLERANCE),
+    округление (MASK_ROUND/MASK_DECIMALS) и tolist выполняются над одним общим
+    массивом всех вершин, а не над каждой точкой по отдельности.
+    """
+    if not len(polygons):
+        return []
+    if settings.MASK_SIMPLIFY_TOLERANCE > 0:
+        polygons = [simplify_polygon(polygon, settings.MASK_SIMPLIFY_TOLERANCE) for polygon in polygons]
+
+    offsets = np.cumsum([0] + [len(polygon) for polygon in polygons])
+    points = np.concatenate(polygons).astype(np.float64)
+    if settings.MASK_ROUND:
+        points = np.round(points, settings.MASK_DECIMALS)
+    # Сотни тысяч мелких списков иначе несколько раз запускают сборщик мусора
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        flat = points.tolist()
+        return [flat[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+def processed_prediction(result: list, windows: np.ndarray, height: int, width: int):
+    """
+    Переводит результаты плиток в глобальные координаты. Вершины всех масок
+    плитки сдвигаются одним сложением над общим массивом; полигоны дальше
+    живут как views этого массива, в списки переводятся один раз в конце.
+    """
+    boxes_tiles, points_tiles, lengths = [], [], []
+    class_ids, confs, tile_ids = [], [], []
+    names = result[0].names if result else {}
 
     for idx, det in enumerate(result):
-        row = idx // settings.GRID_COLS
-        col = idx %  settings.GRID_COLS
-
-        shift_x, shift_y = col * part_w, row * part_h
+        if det.boxes is None or not len(det.boxes):
+            continue
+        shift = windows[idx, :2].astype(np.float32)
 
         # --- Masks ---
         if det.masks is not None:
-            for mask in det.masks.xy:
-                masks_global.append([
-                    [ float(pt[0] + shift_x), float(pt[1] + shift_y) ]
-                    for pt in mask
-                ])
+            xy = det.masks.xy
+            lengths.extend(len(mask) for mask in xy)
+            points_tiles.append(np.concatenate(xy).reshape(-1, 2) + shift)
 
         # --- Boxes ---
-        if det.boxes is not None:
-            for box in det.boxes.xyxy:
-                x1, y1, x2, y2 = box.tolist()
-                boxes_global.append([
-                    float(x1 + shift_x), float(y1 + shift_y),
-                    float(x2 + shift_x), float(y2 + shift_y)
-                ])
-
-            classes.extend([det.names[c] for c in det.boxes.cls.tolist()])
-            class_ids.extend(det.boxes.cls.tolist())
-            confs.extend(det.boxes.conf.tolist())
+        boxes_tiles.append(det.boxes.xyxy.cpu().numpy() + np.tile(shift, 2))
+        class_ids.append(det.boxes.cls.cpu().numpy())
+        confs.append(det.boxes.conf.cpu().numpy())
+        tile_ids.append(np.full(len(det.boxes), idx))
+
+    masks_global = []
+    if boxes_tiles:
+        if points_tiles:
+            masks_global = np.split(np.concatenate(points_tiles), np.cumsum(lengths)[:-1])
+        boxes, confs, class_ids, masks_global = merge_detections(
+            boxes=np.concatenate(boxes_tiles),
+            confs=np.concatenate(confs),
+            class_ids=np.concatenate(class_ids).astype(np.int64),
+            tile_ids=np.concatenate(tile_ids),
+            masks=masks_global,
+            windows=windows,
+            height=height,
+            width=width,
+        )
+    else:
+        boxes, confs, class_ids = np.empty((0, 4)), np.empty(0), np.empty(0, dtype=np.int64)
+
+    class_ids = class_ids.tolist()
+    classes = [names[c] for c in class_ids]
     ind_cls = {int(i):v for i,v in zip(class_ids, classes)}
     return {
         "message": "Prediction completed successfully",
-        "masks": masks_global,
-        "boxes": boxes_global,
+        "masks": serialize_polygons(masks_global),
+        "boxes": boxes.astype(np.float64).tolist(),
         "classes": classes,
         "num_classes": class_ids,
         "ind_cls": ind_cls,
-        "confs": confs,
+        "confs": confs.astype(np.float64).tolist(),
         "detected_objects": len(class_ids),
-    }
\ No newline at end of file
+    }
+
+async def download_image(s3: s3_dependency, path_to_image: str):
+    """
+    Скачивает оригинал из S3 по ключу (последний сегмент сохранённого URL)
+    частями в заранее выделенный буфер, без промежуточных копий.
+    """
+    key = path_to_image.rsplit("/", 1)[-1]
+    with stage("download"):
+        response = await s3.get_object(Bucket=settings.S3_BUCKET_NAME_IMAGES, Key=key)
+        buffer = bytearray(response["ContentLength"])
+        view = memoryview(buffer)
+        offset = 0
+        async with response["Body"] as stream:
+            async for chunk in stream.iter_chunks(settings.S3_READ_CHUNK_SIZE):
+                view[offset:offset + len(chunk)] = chunk
+                offset += len(chunk)
+    return buffer
+
+def decode_image(bytes_img: bytes):
+    combined_image = cv2.imdecode(np.frombuffer(bytes_img, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if combined_image is None:
+        raise ValueError("Не удалось декодировать изображение")
+    return combined_image
@@ -0,0 +1,83 @@
+"""
+Воркер PDF-отчётов: отдельный процесс, который разбирает очередь report_jobs
+в Postgres и не конкурирует с инференсом за CPU model-service.
+
+    python -m modelService.report_worker
+
+Можно запускать несколько экземпляров: задачи забираются через
+FOR UPDATE SKIP LOCKED, упавшая задача повторяется до REPORT_MAX_ATTEMPTS раз.
+Метрики отдаются на порту REPORT_WORKER_METRICS_PORT, задача выполняется
+с request id запроса, который поставил её в очередь.
+"""
+import asyncio
+from common import metrics
+from common.metrics import request_context, start_metrics_server
+from configs.config import settings
+from dbmodels.crud import claim_report_jobs, complete_report_job, fail_report_job
+from dbmodels.database import async_session_maker, engine, get_s3_client, start_s3_client, stop_s3_client
+from .modelseg.reports import generate_report
+
+
+class ReportWorker:
+    def __init__(self, concurrency: int, poll_interval: float):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._running = set()
+
+    async def process(self, job):
+        with request_context(job.request_id) as request_id:
+            metrics.REPORT_JOBS_RUNNING.inc()
+            try:
+                await self._process(job, request_id)
+            finally:
+                metrics.REPORT_JOBS_RUNNING.dec()
+
+    async def _process(self, job, request_id: str):
+        try:
+            path_to_report = await generate_report(await get_s3_client(), user_id=job.user_id, file_id=job.file_id)
+        except Exception as e:
+            metrics.REPORT_JOBS.labels("failed").inc()
+            print(f"[{request_id}] Report job {job.id} failed (attempt {job.attempts}): {str(e)}")
+            async with async_session_maker() as db:
+                await fail_report_job(job.id, job.claim_token, job.attempts, str(e), db)
+            return
+        async with async_session_maker() as db:
+            await complete_report_job(job.id, job.claim_token, job.user_id, job.file_id, path_to_report, db)
+        metrics.REPORT_JOBS.labels("done").inc()
+        print(f"[{request_id}] Report job {job.id} done: {path_to_report}")
+
+    async def run(self):
+        while True:
+            free = self.concurrency - len(self._running)
+            jobs = []
+            if free > 0:
+                try:
+                    async with async_session_maker() as db:
+                        jobs = await claim_report_jobs(free, db)
+                except Exception as e:
+                    print(f"Failed to claim report jobs: {str(e)}")
+            for job in jobs:
+                task = asyncio.create_task(self.process(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+            if len(jobs) < max(free, 1):
+                await asyncio.sleep(self.poll_interval)
+
+    async def stop(self):
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+
+async def main():
+    start_metrics_server(settings.REPORT_WORKER_METRICS_PORT)
+    await start_s3_client()
+    worker = ReportWorker(concurrency=settings.REPORT_WORKER_CONCURRENCY, poll_interval=settings.REPORT_POLL_INTERVAL)
+    try:
+        await worker.run()
+    finally:
+        await worker.stop()
+        await stop_s3_client()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())